@@ -0,0 +1,227 @@
+"""
+Benchmark suite: grid, save, payroll and export endpoints at several scales.
+
+Each scale runs in its own process against a fresh database seeded with
+seed_scale (a throwaway SQLite file unless --database-url names an empty
+database), and drives the FastAPI app in-process through TestClient. For
+every case it records latency percentiles over --repeat runs, the SQL
+statements per request and the peak Python allocation (tracemalloc, in a
+separate untimed run, as tracing slows the timed runs several-fold).
+
+Results are written as JSON and compared with a stored baseline; the script
+exits non-zero when a case got slower than --latency-tolerance, allocates more
+than --memory-tolerance or issues more SQL statements than the baseline.
+
+    python benchmarks/bench_endpoints.py                      # run and compare
+    python benchmarks/bench_endpoints.py --update-baseline    # accept the current numbers
+
+Latency baselines are machine-specific: refresh them when changing hardware.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline_endpoints.json")
+SAVE_SIZES = (100, 1000, 10000)
+
+
+def _worker(args):
+    """Seeds one scale and prints its measurements as JSON on the last stdout line."""
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='bench-endpoints-'), 'bench.db')}"
+    os.environ.pop("DATABASE_REPLICA_URL", None)
+    sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event, select
+    from sqlalchemy.engine import Engine
+
+    import database
+    import main
+    import models
+    import payroll_cache
+    import seed
+    import seed_scale
+
+    statements = []
+    event.listen(Engine, "before_cursor_execute", lambda *a: statements.append(1))
+
+    models.Base.metadata.create_all(bind=database.engine)
+    seed.seed_data()
+    seed_args = argparse.Namespace(
+        employees=args.employees, months=args.months, depth=2, fanout=5, positions=10, fill=0.85,
+        mix=seed_scale.DEFAULT_MIX, users=0, password="bench", seed=args.seed,
+    )
+    seed_scale.generate(seed_args)
+
+    db = database.SessionLocal()
+    root_id = db.execute(select(models.Department.id).where(models.Department.name == seed_scale.ROOT_NAME)).scalar()
+    service_id = db.execute(select(models.Department.id).where(models.Department.parent_id == root_id)
+                            .order_by(models.Department.id)).scalars().first()
+    employee_ids = db.execute(select(models.Employee.id).where(models.Employee.tab_number.like("SYN-%"))
+                              .order_by(models.Employee.id)).scalars().all()
+    code_ids = db.execute(select(models.WorkCode.id).order_by(models.WorkCode.id)).scalars().all()
+    db.close()
+
+    client = TestClient(main.app)
+    token = client.post("/api/auth/login", data={"username": "Superuser", "password": "admin"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    today = date.today()
+    year_month = f"{today.year:04d}-{today.month:02d}"
+    days = [date(today.year, today.month, d) for d in range(1, 29)]
+
+    def get(path, cold_payroll=False):
+        def run():
+            if cold_payroll:
+                payroll_cache.invalidate_all()
+            response = client.get(path, headers=headers)
+            assert response.status_code == 200, f"{path}: {response.status_code} {response.text[:200]}"
+        return run
+
+    def save(size):
+        cells = [(emp, day) for day in days for emp in employee_ids][:size]
+        runs = iter(range(10 ** 9))
+
+        def run():
+            # A different code each run, so every cell is a real change
+            code = code_ids[next(runs) % len(code_ids)]
+            updates = [{"employee_id": emp, "date": day.isoformat(), "work_code_id": code} for emp, day in cells]
+            response = client.post("/api/timesheet/update", headers=headers, json={"updates": updates})
+            assert response.status_code == 200, f"save {size}: {response.status_code} {response.text[:200]}"
+        return run, len(cells)
+
+    cases = {
+        "grid": get(f"/api/timesheet/{service_id}/{year_month}"),
+        "grid_columnar": get(f"/api/timesheet/{service_id}/{year_month}?format=columnar"),
+    }
+    for size in SAVE_SIZES:
+        run, actual = save(size)
+        cases[f"save_{actual}"] = run
+    cases.update({
+        "payroll": get(f"/api/finance/payroll/{year_month}", cold_payroll=True),
+        "export_t13": get(f"/api/export/t13/{service_id}/{year_month}"),
+        "export_payroll_excel": get(f"/api/finance/payroll/{year_month}/export", cold_payroll=True),
+    })
+
+    results = {}
+    for name, run in cases.items():
+        run()   # warm-up: caches, connection pool, imports
+        latencies, counts = [], []
+        for _ in range(args.repeat):
+            statements.clear()
+            started = time.perf_counter()
+            run()
+            latencies.append(time.perf_counter() - started)
+            counts.append(len(statements))
+        tracemalloc.start()
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        latencies.sort()
+
+        def pct(p):
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 2)
+        results[name] = {
+            "p50_ms": pct(0.50), "p95_ms": pct(0.95), "p99_ms": pct(0.99),
+            "mean_ms": round(statistics.fmean(latencies) * 1000, 2),
+            "sql": max(counts), "peak_mb": round(peak / 1e6, 2),
+        }
+        print(f"  {args.employees:>6} emp  {name:<22} p50 {results[name]['p50_ms']:>9.1f} ms  "
+              f"p95 {results[name]['p95_ms']:>9.1f} ms  sql {results[name]['sql']:>4}  "
+              f"peak {results[name]['peak_mb']:>7.1f} MB", file=sys.stderr)
+    print(json.dumps(results))
+
+
+def compare(results: dict, baseline: dict, latency_tolerance: float, memory_tolerance: float) -> list:
+    regressions = []
+    for scale, cases in results.items():
+        for name, now in cases.items():
+            then = baseline.get(scale, {}).get(name)
+            if then is None:
+                continue
+            if now["p50_ms"] > then["p50_ms"] * latency_tolerance:
+                regressions.append(f"{scale} employees, {name}: p50 {then['p50_ms']} -> {now['p50_ms']} ms")
+            if now["sql"] > then["sql"]:
+                regressions.append(f"{scale} employees, {name}: SQL statements {then['sql']} -> {now['sql']}")
+            # The absolute slack keeps tiny allocations from tripping the ratio
+            if now["peak_mb"] > then["peak_mb"] * memory_tolerance + 1.0:
+                regressions.append(f"{scale} employees, {name}: peak {then['peak_mb']} -> {now['peak_mb']} MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scales", type=int, nargs="+", default=[500, 2000], help="employee counts")
+    parser.add_argument("--months", type=int, default=2, help="months of seeded history")
+    parser.add_argument("--repeat", type=int, default=10, help="timed runs per case")
+    parser.add_argument("--seed", type=int, default=2024)
+    parser.add_argument("--database-url", help="empty database to seed instead of a temporary SQLite file "
+                                               "(one scale per run)")
+    parser.add_argument("--output", default=os.path.join(tempfile.gettempdir(), "bench_endpoints.json"))
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--latency-tolerance", type=float, default=1.5, help="allowed p50 ratio to the baseline")
+    parser.add_argument("--memory-tolerance", type=float, default=1.25, help="allowed peak-memory ratio")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--employees", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        return _worker(args)
+    if args.database_url and len(args.scales) > 1:
+        parser.error("--database-url needs an empty database per scale; pass a single --scales value")
+
+    results = {}
+    for scale in args.scales:
+        command = [sys.executable, os.path.abspath(__file__), "--worker", "--employees", str(scale),
+                   "--months", str(args.months), "--repeat", str(args.repeat), "--seed", str(args.seed)]
+        if args.database_url:
+            command += ["--database-url", args.database_url]
+        completed = subprocess.run(command, stdout=subprocess.PIPE, text=True)
+        if completed.returncode:
+            raise SystemExit(f"benchmark worker for {scale} employees failed ({completed.returncode})")
+        results[str(scale)] = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    report = {
+        "meta": {"python": platform.python_version(), "machine": platform.machine(),
+                 "months": args.months, "repeat": args.repeat,
+                 "database": "custom" if args.database_url else "sqlite"},
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {args.output}")
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"baseline updated: {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}; run with --update-baseline to create one")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    regressions = compare(results, baseline, args.latency_tolerance, args.memory_tolerance)
+    if regressions:
+        print("REGRESSIONS against the baseline:")
+        for line in regressions:
+            print(f"  {line}")
+        raise SystemExit(1)
+    print("no regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
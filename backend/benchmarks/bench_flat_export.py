@@ -0,0 +1,141 @@
+"""
+Benchmark: streaming CSV / NDJSON exports vs the openpyxl T-13 workbook.
+
+Fills a throwaway SQLite database with a synthetic organisation (default
+2,000 employees with ~75% of days marked for 12 months), then drains the
+flat_export generators for the whole year and builds the T-13 workbook for
+one month, both saved whole and streamed (with the time to its first chunk). Reports rows/s, MB/s and the peak Python allocation of each run
+(tracemalloc, measured in a separate run), which should stay flat for the streaming exports as the
+extract grows.
+
+    python benchmarks/bench_flat_export.py [--employees 2000] [--months 12]
+"""
+import argparse
+import calendar
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+_tmp = tempfile.mkdtemp(prefix="bench-flat-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp, 'bench.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+import department_closure  # noqa: E402
+import flat_export  # noqa: E402
+import models  # noqa: E402
+import month_totals  # noqa: E402
+from department_tree import get_department_tree  # noqa: E402
+from t13_export import build_t13_workbook, load_t13_data, stream_workbook, write_t13_workbook  # noqa: E402
+
+WORK_CODES = [("8", 8.0, 0.0, 1.0), ("Д", 12.0, 0.0, 1.0), ("Н", 8.0, 4.0, 1.5), ("О", 0.0, 0.0, 1.0)]
+
+
+def populate(employees: int, first_day: date, last_day: date, density: float):
+    models.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    rng = random.Random(7)
+    db.add_all(models.WorkCode(code=c, label=c, hours_standard=s, hours_night=n, rate_multiplier=m)
+               for c, s, n, m in WORK_CODES)
+    root = models.Department(name="Org", category=1)
+    db.add(root)
+    db.flush()
+    depts = [models.Department(name=f"Dept {i}", parent_id=root.id) for i in range(20)]
+    position = models.Position(name="Operator")
+    db.add_all(depts + [position])
+    db.flush()
+    db.add_all(models.SalaryRate(dept_id=d.id, position_id=position.id, hourly_rate=10.0 + i)
+               for i, d in enumerate(depts))
+    db.execute(models.Employee.__table__.insert(), [
+        {"full_name": f"Employee {i}", "tab_number": f"{i:06d}", "dept_id": rng.choice(depts).id,
+         "position_id": position.id, "category": rng.randint(1, 4)}
+        for i in range(employees)
+    ])
+    code_ids = [wc.id for wc in db.query(models.WorkCode)]
+    day = first_day
+    while day <= last_day:
+        db.execute(models.Timesheet.__table__.insert(), [
+            {"employee_id": emp_id, "date": day, "work_code_id": rng.choice(code_ids)}
+            for emp_id in range(1, employees + 1) if rng.random() < density
+        ])
+        day += timedelta(days=1)
+    department_closure.rebuild(db)
+    month_totals.rebuild(db)
+    db.commit()
+    db.close()
+
+
+def measure(label, produce):
+    started = time.perf_counter()
+    size, rows = produce()
+    elapsed = time.perf_counter() - started
+    # Second run for the allocation peak: tracing slows the timed run several-fold
+    tracemalloc.start()
+    produce()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rate = f"{rows / elapsed:12,.0f} rows/s" if rows else " " * 19
+    print(f"  {label:<34} {elapsed:7.2f} s  {rate}  {size / elapsed / 1e6:6.1f} MB/s  peak {peak / 1e6:7.1f} MB")
+
+
+def drain(stream):
+    size = rows = 0
+    for chunk in stream:
+        size += len(chunk)
+        rows += chunk.count(b"\n")
+    return size, rows - 1 if rows else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--employees", type=int, default=2000)
+    parser.add_argument("--months", type=int, default=12)
+    parser.add_argument("--year", type=int, default=2025)
+    parser.add_argument("--density", type=float, default=0.75)
+    args = parser.parse_args()
+
+    first = (args.year, 1)
+    last = (args.year + (args.months - 1) // 12, (args.months - 1) % 12 + 1)
+    started = time.perf_counter()
+    populate(args.employees, date(*first, 1), date(*last, calendar.monthrange(*last)[1]), args.density)
+    print(f"{args.employees} employees, {args.months} months (setup {time.perf_counter() - started:.1f} s)")
+
+    for fmt in ("csv", "ndjson"):
+        measure(f"timesheet {fmt} ({args.months} months)", lambda: drain(flat_export.stream_timesheet(fmt, first, last)))
+    for fmt in ("csv", "ndjson"):
+        measure(f"payroll {fmt} ({args.months} months)", lambda: drain(flat_export.stream_payroll(fmt, first, last)))
+
+    db = database.SessionLocal()
+    try:
+        tree = get_department_tree(db)
+        data = load_t13_data(db, tree, tree.children[None][0], *first)
+    finally:
+        db.close()
+
+    def t13_one_month():
+        buf = io.BytesIO()
+        build_t13_workbook(data).save(buf)
+        return buf.tell(), len(data.employees)
+    measure("T-13 xlsx (1 month, employees)", t13_one_month)
+
+    def t13_streamed():
+        return sum(len(chunk) for chunk in stream_workbook(lambda sink: write_t13_workbook(data, sink))), \
+            len(data.employees)
+    measure("T-13 xlsx streamed", t13_streamed)
+
+    started = time.perf_counter()
+    stream = stream_workbook(lambda sink: write_t13_workbook(data, sink))
+    next(stream)
+    first_byte = time.perf_counter() - started
+    for _ in stream:
+        pass
+    print(f"  {'T-13 xlsx streamed, first chunk':<34} {first_byte:7.2f} s  "
+          f"of {time.perf_counter() - started:.2f} s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Check: cached export jobs are invalidated by work-code edits.
+
+Seeds a throwaway SQLite database, marks a day with the "Д" code and queues
+the same T-13 export job twice (the second must be served from the cache).
+It then renames the code and queues the job again: that one must miss the
+cache, and its workbook must show the new code. Exits non-zero on failure.
+
+    python benchmarks/check_export_cache.py
+"""
+import io
+import os
+import sys
+import tempfile
+import time
+from datetime import date
+
+_tmp = tempfile.mkdtemp(prefix="export-cache-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp, 'cache.db')}"
+os.environ["EXPORT_CACHE_DIR"] = os.path.join(_tmp, "exports")
+os.environ.pop("DATABASE_REPLICA_URL", None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient  # noqa: E402
+from openpyxl import load_workbook  # noqa: E402
+
+import database  # noqa: E402
+import main  # noqa: E402
+import migrate  # noqa: E402
+import models  # noqa: E402
+import seed  # noqa: E402
+
+RENAMED = "DD"
+
+
+def run_job(client, headers, payload) -> dict:
+    job = client.post("/api/export/jobs", headers=headers, json=payload).json()
+    deadline = time.time() + 60
+    while job["status"] not in ("done", "failed"):
+        if time.time() > deadline:
+            raise SystemExit(f"export job {job['id']} did not finish")
+        time.sleep(0.05)
+        job = client.get(f"/api/export/jobs/{job['id']}", headers=headers).json()
+    if job["status"] == "failed":
+        raise SystemExit(f"export job failed: {job['error']}")
+    return job
+
+
+def workbook_values(client, headers, job) -> set:
+    content = client.get(job["download_url"], headers=headers).content
+    sheet = load_workbook(io.BytesIO(content), read_only=True).active
+    return {cell for row in sheet.iter_rows(values_only=True) for cell in row if cell is not None}
+
+
+def main_():
+    migrate.migrate()
+    seed.seed_data()
+    db = database.SessionLocal()
+    employee = db.query(models.Employee).order_by(models.Employee.id).first()
+    code = db.query(models.WorkCode).filter(models.WorkCode.code == "Д").one()
+    today = date.today()
+    db.merge(models.Timesheet(employee_id=employee.id, date=today.replace(day=1), work_code_id=code.id))
+    db.commit()
+    dept_id, code_id = employee.dept_id, code.id
+    code_fields = {key: getattr(code, key) for key in
+                   ("code", "label", "hours_standard", "hours_night", "color_hex", "rate_multiplier")}
+    db.close()
+
+    with TestClient(main.app) as client:
+        token = client.post("/api/auth/login", data={"username": "Superuser", "password": "admin"}).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        payload = {"kind": "t13", "year_month": today.strftime("%Y-%m"), "dept_id": dept_id}
+
+        first = run_job(client, headers, payload)
+        second = run_job(client, headers, payload)
+        if not second["cached"]:
+            raise SystemExit("an unchanged T-13 export was rebuilt instead of served from the cache")
+
+        response = client.put(f"/api/work-codes/{code_id}", headers=headers, json={**code_fields, "code": RENAMED})
+        if response.status_code != 200:
+            raise SystemExit(f"renaming the work code failed: HTTP {response.status_code} {response.text[:200]}")
+        third = run_job(client, headers, payload)
+        if third["cached"]:
+            raise SystemExit("T-13 export after renaming a work code was served from the cache")
+        values = workbook_values(client, headers, third)
+        if RENAMED not in values or "Д" in values:
+            raise SystemExit(f"T-13 export after the rename does not show '{RENAMED}' in place of 'Д'")
+    print(f"ok: job {first['id']} cached on repeat, rebuilt after renaming Д -> {RENAMED}")
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,149 @@
+"""
+Check: list and export endpoints run a fixed number of SQL queries.
+
+Fills a throwaway SQLite database with a small organisation, counts the
+statements each endpoint executes (sync and async engines alike), then
+grows the organisation several-fold and counts again. Any endpoint whose
+count changes has a per-row lazy load (N+1) and is reported; the script
+exits non-zero so it can gate CI.
+
+    python benchmarks/check_query_counts.py [--employees 30] [--growth 4]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+from datetime import date, datetime
+
+_tmp = tempfile.mkdtemp(prefix="query-counts-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp, 'counts.db')}"
+os.environ.pop("DATABASE_REPLICA_URL", None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+from sqlalchemy.engine import Engine  # noqa: E402
+
+import database  # noqa: E402
+import department_closure  # noqa: E402
+import main  # noqa: E402
+import models  # noqa: E402
+import month_totals  # noqa: E402
+import payroll_cache  # noqa: E402
+import seed  # noqa: E402
+from department_tree import invalidate_department_tree  # noqa: E402
+
+YEAR, MONTH = 2026, 3
+
+ENDPOINTS = [
+    "/api/users",
+    "/api/employees",
+    "/api/employees?dept_id={dept}",
+    "/api/timesheet/{dept}/{month}",
+    "/api/timesheet/{dept}/{month}?format=columnar",
+    "/api/salary-rates",
+    "/api/finance/payroll/{month}",
+    "/api/finance/payroll/{month}/export",
+    "/api/finance/audit-log",
+    "/api/export/t13/{dept}/{month}",
+]
+
+_statements = []
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count(conn, cursor, statement, parameters, context, executemany):
+    _statements.append(statement)
+
+
+def grow(employees: int, rng: random.Random):
+    """Adds `employees` employees, each with a user, marks and an audit entry."""
+    db = database.SessionLocal()
+    try:
+        root = db.query(models.Department).filter(models.Department.parent_id.is_(None)).first()
+        depts = [models.Department(name=f"Dept {rng.random():.6f}", parent_id=root.id) for _ in range(3)]
+        positions = [models.Position(name=f"Position {rng.random():.6f}") for _ in range(3)]
+        roles = [models.Role(name=f"Role {rng.random():.6f}") for _ in range(2)]
+        db.add_all(depts + positions + roles)
+        db.flush()
+        for dept in depts:
+            department_closure.add_department(db, dept.id, dept.parent_id)
+        db.add_all(models.SalaryRate(dept_id=d.id, position_id=p.id, hourly_rate=rng.uniform(5, 20))
+                   for d in depts for p in positions)
+        code_ids = [wc.id for wc in db.query(models.WorkCode)]
+        for _ in range(employees):
+            emp = models.Employee(full_name=f"Employee {rng.random():.6f}", tab_number=f"{rng.randrange(10**8):08d}",
+                                  dept_id=rng.choice(depts).id, position_id=rng.choice(positions).id)
+            db.add(emp)
+            db.flush()
+            user = models.User(username=f"user-{emp.id}", hashed_password="-", role_id=rng.choice(roles).id,
+                               employee_id=emp.id)
+            db.add(user)
+            db.flush()
+            db.add(models.FinanceAuditLog(user_id=user.id, action="update_rate", target=emp.full_name,
+                                          timestamp=datetime.utcnow()))
+            db.add_all(models.Timesheet(employee_id=emp.id, date=date(YEAR, MONTH, day),
+                                        work_code_id=rng.choice(code_ids))
+                       for day in range(1, 29) if rng.random() < 0.7)
+        month_totals.rebuild(db)
+        db.commit()
+        return root.id
+    finally:
+        db.close()
+
+
+def count_queries(client, headers, paths):
+    for path in paths:
+        client.get(path, headers=headers)  # warm the principal and department tree caches
+    counts = {}
+    for path in paths:
+        payroll_cache.invalidate_all()
+        _statements.clear()
+        response = client.get(path, headers=headers)
+        if response.status_code != 200:
+            raise SystemExit(f"{path}: HTTP {response.status_code} {response.text[:200]}")
+        counts[path] = len(_statements)
+    return counts
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--employees", type=int, default=30, help="employees in the first round")
+    parser.add_argument("--growth", type=int, default=4, help="size of the second round relative to the first")
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=database.engine)
+    seed.seed_data()
+    db = database.SessionLocal()
+    department_closure.rebuild(db)
+    db.commit()
+    db.close()
+
+    rng = random.Random(18)
+    client = TestClient(main.app)
+    token = client.post("/api/auth/login", data={"username": "Superuser", "password": "admin"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    rounds = []
+    total = 0
+    for employees in (args.employees, args.employees * (args.growth - 1)):
+        root_id = grow(employees, rng)
+        total += employees
+        invalidate_department_tree()
+        paths = [p.format(dept=root_id, month=f"{YEAR:04d}-{MONTH:02d}") for p in ENDPOINTS]
+        rounds.append((total, count_queries(client, headers, paths)))
+
+    (small, before), (large, after) = rounds
+    print(f"  {'endpoint':<46} {small:>6} emp {large:>6} emp")
+    failures = 0
+    for path in before:
+        flag = "" if before[path] == after[path] else "  <-- grows with employees"
+        failures += bool(flag)
+        print(f"  {path:<46} {before[path]:>10} {after[path]:>10}{flag}")
+    if failures:
+        raise SystemExit(f"{failures} endpoint(s) issue per-row queries")
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,95 @@
+"""
+Check: the streamed T-13 workbook round-trips through openpyxl.
+
+Builds a synthetic month (banners, empty and marked days, Cyrillic codes),
+streams it with stream_workbook(write_t13_workbook) and compares it with the
+workbook.save() of build_t13_workbook: the same zip parts with the same bytes
+(core.xml aside, it holds the save time), and the same cell values, merged
+banners and column widths once read back with load_workbook. Also fails when
+the first chunk only arrives with the last one. Run it after changing the
+openpyxl pin in requirements.txt. Exits non-zero on failure.
+
+    python benchmarks/check_t13_stream.py [--employees 3000]
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import openpyxl  # noqa: E402
+from openpyxl import load_workbook  # noqa: E402
+
+from department_tree import DepartmentNode  # noqa: E402
+from t13_export import (STREAMING_OPENPYXL, T13Data, T13Employee, build_t13_workbook,  # noqa: E402
+                        stream_workbook, write_t13_workbook)
+
+CODES = ["", "", "8", "Д", "Н", "О", "Б"]
+
+
+def synthetic_month(employees: int) -> T13Data:
+    rng = random.Random(13)
+    departments = [DepartmentNode(1, "Org", None, 1)] + \
+        [DepartmentNode(i, f"Dept {i}", 1, 2) for i in range(2, 12)]
+    staff = [T13Employee(i, f"Employee {i}", f"{i:06d}", rng.choice([1, 2, None]), rng.randint(2, 11),
+                         rng.choice(["Operator", None]))
+             for i in range(1, employees + 1)]
+    return T13Data(
+        year_month="2026-10",
+        last_day=31,
+        departments=departments,
+        employees=staff,
+        codes={emp.id: [rng.choice(CODES) for _ in range(31)] for emp in staff},
+        totals={emp.id: (160.0, 8.0, 168.0) for emp in staff},
+    )
+
+
+def sheet_snapshot(content: bytes):
+    ws = load_workbook(io.BytesIO(content)).active
+    widths = {key: dim.width for key, dim in ws.column_dimensions.items()}
+    return ws.title, list(ws.values), sorted(str(r) for r in ws.merged_cells.ranges), widths
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--employees", type=int, default=3000)
+    args = parser.parse_args()
+    if openpyxl.__version__ != STREAMING_OPENPYXL:
+        raise SystemExit(f"openpyxl {openpyxl.__version__} is installed, streaming is checked against "
+                         f"{STREAMING_OPENPYXL}; install the pinned version (or update STREAMING_OPENPYXL)")
+    data = synthetic_month(args.employees)
+
+    saved = io.BytesIO()
+    build_t13_workbook(data).save(saved)
+
+    chunks, arrivals = [], []
+    started = time.perf_counter()
+    for chunk in stream_workbook(lambda sink: write_t13_workbook(data, sink)):
+        arrivals.append(time.perf_counter() - started)
+        chunks.append(chunk)
+    streamed = b"".join(chunks)
+
+    expected, actual = zipfile.ZipFile(saved), zipfile.ZipFile(io.BytesIO(streamed))
+    if actual.testzip() is not None:
+        raise SystemExit(f"corrupt zip member in the streamed workbook: {actual.testzip()}")
+    if sorted(expected.namelist()) != sorted(actual.namelist()):
+        raise SystemExit(f"zip parts differ: {sorted(expected.namelist())} vs {sorted(actual.namelist())}")
+    changed = [name for name in expected.namelist()
+               if name != "docProps/core.xml" and expected.read(name) != actual.read(name)]
+    if changed:
+        raise SystemExit(f"streamed parts differ from workbook.save(): {changed}")
+    if sheet_snapshot(streamed) != sheet_snapshot(saved.getvalue()):
+        raise SystemExit("streamed workbook reads back differently from workbook.save()")
+    if len(chunks) > 1 and arrivals[0] >= arrivals[-1] * 0.9:
+        raise SystemExit(f"first chunk after {arrivals[0]:.2f} s of {arrivals[-1]:.2f} s: rows are not streamed")
+
+    print(f"ok: {args.employees} employees, {len(streamed):,} bytes in {len(chunks)} chunks, "
+          f"first after {arrivals[0]:.2f} s of {arrivals[-1]:.2f} s")
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,129 @@
+"""
+Index check: plans of the grid, save, payroll and permission queries.
+
+Compiles the statements the endpoints issue (sample ids taken from the
+database: the department with the largest subtree, one of its employees, a
+user) and prints their plans, EXPLAIN on PostgreSQL, EXPLAIN QUERY PLAN on
+SQLite. Also lists the indexes from migrate_performance_indexes.py that the
+database lacks, and exits non-zero when any are missing.
+
+    DATABASE_URL=postgresql://... python benchmarks/explain_hot_queries.py [--analyze]
+
+Sequential scans over employees, departments, users or salary_rates on a
+realistically sized database usually mean the migrations have not run.
+"""
+import argparse
+import calendar
+import os
+import sys
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func, select  # noqa: E402
+from sqlalchemy.orm import joinedload  # noqa: E402
+
+import models  # noqa: E402
+from database import SessionLocal, engine  # noqa: E402
+from department_closure import in_subtree  # noqa: E402
+from migrate_performance_indexes import INDEXES, existing_indexes, unique_columns  # noqa: E402
+
+
+def _samples(db):
+    closure = models.DepartmentClosure
+    dept_id = db.execute(
+        select(closure.ancestor_id).join(models.Employee, models.Employee.dept_id == closure.descendant_id)
+        .group_by(closure.ancestor_id).order_by(func.count().desc(), closure.ancestor_id).limit(1)
+    ).scalar()
+    employee_ids = db.execute(
+        select(models.Employee.id).where(in_subtree(models.Employee.dept_id, dept_id))
+        .order_by(models.Employee.id).limit(20)
+    ).scalars().all() if dept_id is not None else []
+    username = db.execute(select(models.User.username).order_by(models.User.id).limit(1)).scalar()
+    rate = db.execute(select(models.SalaryRate.dept_id, models.SalaryRate.position_id).limit(1)).first()
+    return dept_id, employee_ids, username, rate
+
+
+def hot_queries(db, year: int, month: int):
+    """(name, statement) for the queries the indexes are meant for."""
+    dept_id, employee_ids, username, rate = _samples(db)
+    if dept_id is None:
+        raise SystemExit("no employees in the database; seed it first (python seed.py --scale)")
+    start = date(year, month, 1)
+    end = date(year, month, calendar.monthrange(year, month)[1])
+    Employee, Timesheet = models.Employee, models.Timesheet
+
+    queries = [
+        ("grid: employees of the subtree",
+         select(Employee.id, Employee.dept_id).where(in_subtree(Employee.dept_id, dept_id)).order_by(Employee.id)),
+        ("grid: marks of the month",
+         select(Timesheet.employee_id, Timesheet.date, Timesheet.work_code_id)
+         .join(Employee, Timesheet.employee_id == Employee.id)
+         .where(Timesheet.date >= start, Timesheet.date <= end, in_subtree(Employee.dept_id, dept_id))),
+        ("save: current codes of the touched cells",
+         select(Timesheet.employee_id, Timesheet.date, Timesheet.work_code_id)
+         .where(Timesheet.employee_id.in_(employee_ids), Timesheet.date >= start, Timesheet.date <= end)),
+        ("save: lock and scope the touched employees",
+         select(Employee.id, Employee.dept_id).where(Employee.id.in_(employee_ids))
+         .order_by(Employee.id).with_for_update()),
+        ("payroll: whole month (monthly rollup)", models.payroll_hours_statement(start, end)),
+        ("payroll: partial month (timesheet marks)", models.payroll_hours_statement(start, start.replace(day=15))),
+        ("permission: principal by username",
+         select(models.User).options(joinedload(models.User.role), joinedload(models.User.employee))
+         .where(models.User.username == username)),
+        ("permission: users linked to an employee",
+         select(models.User.id).where(models.User.employee_id == employee_ids[0])),
+        ("departments: child lookup", select(models.Department.id).where(models.Department.parent_id == dept_id)),
+    ]
+    if rate is not None:
+        queries.append(("finance: rate of a department and position",
+                        select(models.SalaryRate).where(models.SalaryRate.dept_id == rate.dept_id,
+                                                        models.SalaryRate.position_id == rate.position_id)))
+    return queries
+
+
+def explain(conn, statement, analyze: bool) -> str:
+    sql = str(statement.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+    if conn.dialect.name == "sqlite":
+        prefix = "EXPLAIN QUERY PLAN "
+    else:
+        prefix = "EXPLAIN (ANALYZE, BUFFERS) " if analyze else "EXPLAIN "
+    rows = conn.exec_driver_sql(prefix + sql).fetchall()
+    if conn.dialect.name == "sqlite":
+        return "\n".join(f"  {row[-1]}" for row in rows)
+    return "\n".join(f"  {row[0]}" for row in rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--month", default=date.today().strftime("%Y-%m"), help="YYYY-MM")
+    parser.add_argument("--analyze", action="store_true",
+                        help="EXPLAIN (ANALYZE, BUFFERS) on PostgreSQL; runs the queries")
+    args = parser.parse_args()
+    year, month = map(int, args.month.split("-"))
+
+    db = SessionLocal()
+    try:
+        queries = hot_queries(db, year, month)
+    finally:
+        db.close()
+
+    with engine.connect() as conn:
+        for name, statement in queries:
+            print(f"-- {name}\n{explain(conn, statement, args.analyze)}\n")
+        # FOR UPDATE above took row locks; nothing was written
+        conn.rollback()
+        missing = [f"{name} on {table}" for name, table, columns, unique in INDEXES
+                   if name not in existing_indexes(conn, table)
+                   and not (unique and tuple(columns) in unique_columns(conn, table))]
+
+    if missing:
+        print("MISSING indexes (run python migrate.py):")
+        for line in missing:
+            print(f"  {line}")
+        raise SystemExit(1)
+    print(f"all {len(INDEXES)} performance indexes present")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Load test: concurrent-request capacity of the read-heavy endpoints.
+
+Fires GET requests at one or more running API servers with a fixed number of
+concurrent clients per step and reports throughput, latency percentiles and
+errors for each step. Run it against a build with the sync handlers and one
+with the async handlers (same database) to compare them:
+
+    python benchmarks/load_read_endpoints.py \\
+        --target before=http://localhost:8001 --target after=http://localhost:8000 \\
+        --concurrency 10 40 80 160 --duration 15 --month 2026-03 --dept 1
+
+Requests carry no If-None-Match header, so the grid is always rendered
+rather than answered with 304.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+ENDPOINTS = [
+    "/api/work-codes",
+    "/api/departments",
+    "/api/employees",
+    "/api/timesheet/{dept}/{month}",
+    "/api/finance/payroll/{month}",
+]
+
+
+async def login(client: httpx.AsyncClient, username: str, password: str) -> dict:
+    response = await client.post("/api/auth/login", data={"username": username, "password": password})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def run_step(client, headers, paths, concurrency: int, duration: float) -> dict:
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker(offset: int):
+        nonlocal errors
+        i = offset
+        while time.perf_counter() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            started = time.perf_counter()
+            try:
+                response = await client.get(path, headers=headers)
+                if response.status_code != 200:
+                    errors += 1
+                    continue
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else float("nan")
+    return {
+        "concurrency": concurrency,
+        "rps": len(latencies) / elapsed,
+        "p50": pct(0.50), "p95": pct(0.95), "p99": pct(0.99),
+        "mean": statistics.fmean(latencies) * 1000 if latencies else float("nan"),
+        "errors": errors,
+    }
+
+
+async def load_target(label, base_url, args):
+    paths = [p.format(dept=args.dept, month=args.month) for p in ENDPOINTS]
+    limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        headers = await login(client, args.username, args.password)
+        print(f"{label} ({base_url})")
+        print(f"  {'clients':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        for concurrency in args.concurrency:
+            step = await run_step(client, headers, paths, concurrency, args.duration)
+            print(f"  {step['concurrency']:>7} {step['rps']:>9.1f} {step['p50']:>8.1f} "
+                  f"{step['p95']:>8.1f} {step['p99']:>8.1f} {step['errors']:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--target", action="append", default=[],
+                        help="label=base_url, may be repeated (default: api=http://localhost:8000)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 40, 80, 160])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per step")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--month", default=time.strftime("%Y-%m"))
+    parser.add_argument("--dept", type=int, default=1)
+    parser.add_argument("--username", default="Superuser")
+    parser.add_argument("--password", default="admin")
+    args = parser.parse_args()
+
+    targets = [t.split("=", 1) for t in (args.target or ["api=http://localhost:8000"])]
+    for label, base_url in targets:
+        asyncio.run(load_target(label, base_url, args))
+
+
+if __name__ == "__main__":
+    main()
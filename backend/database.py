@@ -1,4 +1,8 @@
 import os
+import threading
+import time
+from typing import Dict, Optional
+
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from models import Base
@@ -13,10 +17,132 @@ SQLALCHEMY_DATABASE_URL = os.getenv(
 if SQLALCHEMY_DATABASE_URL and SQLALCHEMY_DATABASE_URL.startswith("postgres://"):
     SQLALCHEMY_DATABASE_URL = SQLALCHEMY_DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
-# 3. Создаем движок
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# 3. Настройки пула из окружения. pre-ping отбрасывает соединения, умершие после
+# рестарта Postgres; recycle закрывает их раньше, чем это сделает сервер или прокси.
+# Размер пула действует на каждый движок (sync, async, реплика) в каждом процессе.
+def _env_flag(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).strip().lower() in ("1", "true", "yes", "on")
+
+def engine_options(url: str) -> dict:
+    options = {"pool_pre_ping": _env_flag("DB_POOL_PRE_PING", True)}
+    if not url.startswith("sqlite"):
+        options.update(
+            pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+            max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+            pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+            pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        )
+    return options
+
+# 4. Создаем движок
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_options(SQLALCHEMY_DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 5. Необязательная реплика для чтения. GET-эндпоинты читают с нее, кроме
+# пользователей, которые сами писали в последние READ_YOUR_WRITES_SECONDS:
+# они остаются на primary и видят свои изменения. Локально проверяется на двух
+# SQLite-файлах (DATABASE_URL=sqlite:///primary.db DATABASE_REPLICA_URL=sqlite:///replica.db);
+# какая база ответила, видно по заголовку X-DB-Route.
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL") or None
+if DATABASE_REPLICA_URL and DATABASE_REPLICA_URL.startswith("postgres://"):
+    DATABASE_REPLICA_URL = DATABASE_REPLICA_URL.replace("postgres://", "postgresql://", 1)
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+
+replica_engine = (
+    create_engine(DATABASE_REPLICA_URL, **engine_options(DATABASE_REPLICA_URL))
+    if DATABASE_REPLICA_URL else None
+)
+ReplicaSessionLocal = (
+    sessionmaker(autocommit=False, autoflush=False, bind=replica_engine, info={"replica": True})
+    if replica_engine is not None else None
+)
+
+_write_lock = threading.Lock()
+_last_write_by: Dict[str, float] = {}
+_last_write = float("-inf")
+
+def note_write(username: Optional[str]):
+    """Records a committed write; called for every successful non-GET request."""
+    global _last_write
+    now = time.monotonic()
+    with _write_lock:
+        _last_write = now
+        if username:
+            _last_write_by[username] = now
+            if len(_last_write_by) > 10000:
+                cutoff = now - READ_YOUR_WRITES_SECONDS
+                for key in [k for k, t in _last_write_by.items() if t < cutoff]:
+                    del _last_write_by[key]
+
+def replica_allowed(username: Optional[str] = None) -> bool:
+    if replica_engine is None:
+        return False
+    wrote_at = _last_write_by.get(username) if username else None
+    return wrote_at is None or time.monotonic() - wrote_at >= READ_YOUR_WRITES_SECONDS
+
+def replica_settled() -> bool:
+    """True when nobody wrote within the lag window, so the replica has caught up
+    with the version counters and its results may be cached under them."""
+    return time.monotonic() - _last_write >= READ_YOUR_WRITES_SECONDS
+
+def from_replica(db) -> bool:
+    return bool(db.info.get("replica"))
+
+def read_session_factory(username: Optional[str] = None):
+    return ReplicaSessionLocal if replica_allowed(username) else SessionLocal
+
+# 6. Async движок для read-heavy эндпоинтов (asyncpg / aiosqlite).
+# Создается при первом использовании, так что seed.py и миграции его не трогают.
+def _async_url(url: str) -> str:
+    for sync_prefix, async_prefix in (
+        ("postgresql+psycopg2://", "postgresql+asyncpg://"),
+        ("postgresql://", "postgresql+asyncpg://"),
+        ("sqlite://", "sqlite+aiosqlite://"),
+    ):
+        if url.startswith(sync_prefix):
+            return async_prefix + url[len(sync_prefix):]
+    return url
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_url(SQLALCHEMY_DATABASE_URL)
+
+ASYNC_DATABASE_REPLICA_URL = os.getenv("ASYNC_DATABASE_REPLICA_URL") or (
+    _async_url(DATABASE_REPLICA_URL) if DATABASE_REPLICA_URL else None
+)
+
+_async_engines: Dict[bool, object] = {}
+_async_sessionmakers: Dict[bool, object] = {}
+
+def get_async_engine(replica: bool = False):
+    if replica not in _async_engines:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        url = ASYNC_DATABASE_REPLICA_URL if replica else ASYNC_DATABASE_URL
+        _async_engines[replica] = create_async_engine(url, **engine_options(url))
+    return _async_engines[replica]
+
+def AsyncSessionLocal(replica: bool = False):
+    if replica not in _async_sessionmakers:
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+        _async_sessionmakers[replica] = async_sessionmaker(
+            get_async_engine(replica), autoflush=False, expire_on_commit=False,
+            info={"replica": True} if replica else None,
+        )
+    return _async_sessionmakers[replica]()
+
+def async_read_session(username: Optional[str] = None):
+    return AsyncSessionLocal(replica=replica_allowed(username))
+
+async def dispose_async_engine():
+    for async_engine in _async_engines.values():
+        await async_engine.dispose()
+
+def dialect_insert(db):
+    """Returns the INSERT construct with ON CONFLICT support for the session's database."""
+    if db.get_bind().dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert
+    return insert
+
 def init_db():
     # На Render это создаст таблицы в облачной БД при первом запуске
     Base.metadata.create_all(bind=engine)
@@ -0,0 +1,105 @@
+"""
+Closure table for the department hierarchy.
+
+department_closure holds one (ancestor_id, descendant_id, depth) row for every
+department and each of its ancestors, including a depth-0 row linking the
+department to itself. A subtree is then a single indexed lookup on
+ancestor_id, so scoped queries can filter on it in the same statement instead
+of expanding the tree into an IN list first.
+
+The department endpoints keep the table in step with departments.parent_id;
+rebuild() recomputes it from scratch with a recursive CTE.
+"""
+from sqlalchemy import and_, delete, exists, func, insert, literal, select
+from sqlalchemy.orm import aliased
+
+import models
+
+# Guards the recursive CTE against parent_id cycles in legacy data
+MAX_DEPTH = 64
+
+
+def subtree_ids(dept_id: int):
+    """SELECT of dept_id and every department below it."""
+    return select(models.DepartmentClosure.descendant_id).where(
+        models.DepartmentClosure.ancestor_id == dept_id
+    )
+
+
+def in_subtree(column, dept_id: int):
+    """Filter expression: column references a department in dept_id's subtree."""
+    return column.in_(subtree_ids(dept_id))
+
+
+def is_in_subtree(db, dept_id: int, root_id: int) -> bool:
+    return db.query(exists().where(
+        models.DepartmentClosure.ancestor_id == root_id,
+        models.DepartmentClosure.descendant_id == dept_id,
+    )).scalar()
+
+
+def add_department(db, dept_id: int, parent_id=None):
+    """Links a new (leaf) department to itself and to every ancestor of its parent."""
+    closure = models.DepartmentClosure
+    db.execute(insert(closure).values(ancestor_id=dept_id, descendant_id=dept_id, depth=0))
+    if parent_id is not None:
+        db.execute(insert(closure).from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            select(closure.ancestor_id, literal(dept_id), closure.depth + 1)
+            .where(closure.descendant_id == parent_id),
+        ))
+
+
+def move_department(db, dept_id: int, new_parent_id=None):
+    """Re-links dept_id's whole subtree under new_parent_id.
+
+    The caller must make sure new_parent_id is not inside the subtree.
+    """
+    closure = models.DepartmentClosure
+    subtree = select(closure.descendant_id).where(closure.ancestor_id == dept_id)
+    # Drop the links from the old ancestors into the subtree; links inside it stay
+    db.execute(delete(closure).where(
+        closure.descendant_id.in_(subtree),
+        closure.ancestor_id.notin_(subtree),
+    ).execution_options(synchronize_session=False))
+    if new_parent_id is not None:
+        above = aliased(closure)
+        below = aliased(closure)
+        db.execute(insert(closure).from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            select(above.ancestor_id, below.descendant_id, above.depth + below.depth + 1)
+            .select_from(above)
+            .join(below, and_(above.descendant_id == new_parent_id, below.ancestor_id == dept_id)),
+        ))
+
+
+def remove_department(db, dept_id: int):
+    """Unlinks a leaf department (the endpoints refuse to delete non-leaves)."""
+    closure = models.DepartmentClosure
+    db.execute(delete(closure).where(
+        (closure.descendant_id == dept_id) | (closure.ancestor_id == dept_id)
+    ).execution_options(synchronize_session=False))
+
+
+def rebuild(db) -> int:
+    """Recomputes the closure from departments.parent_id. Returns the row count."""
+    dept = models.Department
+    tree = select(
+        dept.id.label("ancestor_id"),
+        dept.id.label("descendant_id"),
+        literal(0).label("depth"),
+    ).cte("tree", recursive=True)
+    tree = tree.union_all(
+        select(tree.c.ancestor_id, dept.id, tree.c.depth + 1)
+        .join(dept, dept.parent_id == tree.c.descendant_id)
+        .where(tree.c.depth < MAX_DEPTH)
+    )
+    db.execute(delete(models.DepartmentClosure).execution_options(synchronize_session=False))
+    db.execute(insert(models.DepartmentClosure).from_select(
+        ["ancestor_id", "descendant_id", "depth"],
+        # A cycle would reach the same pair at several depths; keep the shortest
+        select(tree.c.ancestor_id, tree.c.descendant_id, func.min(tree.c.depth))
+        .group_by(tree.c.ancestor_id, tree.c.descendant_id),
+    ))
+    # rowcount is not reported for INSERT ... SELECT on every driver
+    return db.query(func.count()).select_from(models.DepartmentClosure).scalar()
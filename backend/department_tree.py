@@ -0,0 +1,119 @@
+"""
+Process-wide in-memory index of the department tree.
+
+The index is built from a single SELECT on departments and answers subtree,
+root, service and path lookups without touching the database. Department
+create/update/delete endpoints call invalidate_department_tree() after they
+commit so the next lookup rebuilds it.
+"""
+import threading
+from typing import Dict, List, NamedTuple, Optional
+
+import models
+
+
+class DepartmentNode(NamedTuple):
+    id: int
+    name: str
+    parent_id: Optional[int]
+    category: Optional[int]
+
+
+class DepartmentTree:
+    def __init__(self, nodes):
+        self.nodes: Dict[int, DepartmentNode] = {}
+        # parent_id -> child ids; root departments live under the None key
+        self.children: Dict[Optional[int], List[int]] = {}
+        for node in sorted(nodes, key=lambda n: n.id):
+            self.nodes[node.id] = node
+            self.children.setdefault(node.parent_id, []).append(node.id)
+
+    def descendants(self, dept_id: Optional[int]) -> List[int]:
+        """Returns dept_id followed by every department below it (pre-order).
+
+        dept_id=None walks down from the root departments, which yields every
+        department in the tree.
+        """
+        ids = [dept_id]
+        seen = {dept_id}
+        stack = list(reversed(self.children.get(dept_id, [])))
+        while stack:
+            current = stack.pop()
+            if current in seen:
+                continue
+            seen.add(current)
+            ids.append(current)
+            stack.extend(reversed(self.children.get(current, [])))
+        return ids
+
+    def ancestors(self, dept_id: int) -> List[DepartmentNode]:
+        """Returns the chain from dept_id up to its root, dept_id first."""
+        chain = []
+        seen = set()
+        current = self.nodes.get(dept_id)
+        while current and current.id not in seen:
+            seen.add(current.id)
+            chain.append(current)
+            current = self.nodes.get(current.parent_id) if current.parent_id is not None else None
+        return chain
+
+    def root_id(self, dept_id: Optional[int]) -> Optional[int]:
+        if dept_id is None:
+            return None
+        chain = self.ancestors(dept_id)
+        return chain[-1].id if chain else dept_id
+
+    def root_service(self, dept_id: int) -> Optional[DepartmentNode]:
+        """Nearest ancestor (or the department itself) with category=1 (Service)."""
+        for node in self.ancestors(dept_id):
+            if node.category == 1:
+                return node
+        return None
+
+    def top_services(self) -> List[int]:
+        """Services (category=1) that are not nested in another service.
+
+        An organisation without services falls back to its root departments.
+        """
+        services = [dept_id for dept_id, node in self.nodes.items()
+                    if node.category == 1 and all(a.category != 1 for a in self.ancestors(dept_id)[1:])]
+        return services or list(self.children.get(None, []))
+
+    def path(self, dept_id: int) -> List[DepartmentNode]:
+        return list(reversed(self.ancestors(dept_id)))
+
+    def full_name(self, dept_id: int) -> str:
+        return " » ".join(node.name for node in self.path(dept_id))
+
+
+_lock = threading.Lock()
+_tree: Optional[DepartmentTree] = None
+_generation = 0
+
+
+def get_department_tree(db) -> DepartmentTree:
+    """Returns the cached tree, building it from one query on first use."""
+    global _tree
+    tree = _tree
+    if tree is not None:
+        return tree
+    generation = _generation
+    rows = db.query(
+        models.Department.id,
+        models.Department.name,
+        models.Department.parent_id,
+        models.Department.category,
+    ).all()
+    tree = DepartmentTree(DepartmentNode(*row) for row in rows)
+    with _lock:
+        # Don't publish a tree that was read before a concurrent invalidation
+        if generation == _generation:
+            _tree = tree
+    return tree
+
+
+def invalidate_department_tree():
+    global _tree, _generation
+    with _lock:
+        _generation += 1
+        _tree = None
@@ -0,0 +1,160 @@
+"""
+Background export jobs with an on-disk result cache.
+
+An export is identified by (kind, scope, year_month, data version). submit()
+returns the finished file straight away when that key is already on disk,
+joins the job that is building it if one is in flight, and otherwise queues a
+new job on a bounded worker pool (EXPORT_WORKERS), so exports never occupy the
+request threadpool and at most that many run at once.
+
+The data version comes from the in-process counters (grid_versions and
+payroll_cache), which restart from zero with the process; files written by a
+previous process are therefore discarded when the cache directory is opened.
+Like those counters, the job registry assumes a single API process.
+"""
+import hashlib
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional, Set
+
+import metrics
+from database import SessionLocal
+
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "2"))
+EXPORT_CACHE_DIR = os.getenv("EXPORT_CACHE_DIR", os.path.join("/tmp", "timesheet-exports"))
+# Finished jobs are forgotten after this many seconds (their files stay cached)
+EXPORT_JOB_TTL = float(os.getenv("EXPORT_JOB_TTL", "3600"))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+_instance = uuid.uuid4().hex[:8]
+_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+_jobs: Dict[str, "ExportJob"] = {}
+_inflight: Dict[str, "ExportJob"] = {}   # cache key -> job still building it
+_cache_hits = 0
+
+
+@dataclass
+class ExportJob:
+    id: str
+    kind: str
+    scope: str
+    year_month: str
+    filename: str
+    path: str
+    status: str = QUEUED
+    error: Optional[str] = None
+    cached: bool = False
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    owners: Set[str] = field(default_factory=set)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id, "kind": self.kind, "scope": self.scope,
+            "year_month": self.year_month, "filename": self.filename,
+            "status": self.status, "error": self.error, "cached": self.cached,
+            "download_url": f"/api/export/jobs/{self.id}/download" if self.status == DONE else None,
+        }
+
+
+def _cache_dir() -> str:
+    path = os.path.join(EXPORT_CACHE_DIR, _instance)
+    if not os.path.isdir(path):
+        os.makedirs(path, exist_ok=True)
+        # Files from earlier processes were keyed by counters that no longer exist
+        for entry in os.listdir(EXPORT_CACHE_DIR):
+            if entry != _instance:
+                shutil.rmtree(os.path.join(EXPORT_CACHE_DIR, entry), ignore_errors=True)
+    return path
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=max(1, EXPORT_WORKERS), thread_name_prefix="export")
+    return _executor
+
+
+def _prune():
+    cutoff = time.time() - EXPORT_JOB_TTL
+    for job_id in [jid for jid, job in _jobs.items() if job.finished_at and job.finished_at < cutoff]:
+        del _jobs[job_id]
+
+
+def submit(kind: str, scope: str, year_month: str, version: str, filename: str,
+           build: Callable, owner: str, session_factory: Callable = SessionLocal) -> ExportJob:
+    """Returns a job for the export, starting build(db) -> Workbook only if needed."""
+    global _cache_hits
+    prefix = f"{kind}-{_digest(kind, scope, year_month)}-"
+    key = f"{prefix}{_digest(version)}"
+    path = os.path.join(_cache_dir(), f"{key}.xlsx")
+    with _lock:
+        _prune()
+        job = _inflight.get(key)
+        if job is not None:
+            job.owners.add(owner)
+            return job
+        job = ExportJob(id=uuid.uuid4().hex, kind=kind, scope=scope, year_month=year_month,
+                        filename=filename, path=path, owners={owner})
+        _jobs[job.id] = job
+        if os.path.exists(path):
+            _cache_hits += 1
+            job.status, job.cached, job.finished_at = DONE, True, time.time()
+            return job
+        _inflight[key] = job
+    _pool().submit(_run, job, key, prefix, build, session_factory)
+    return job
+
+
+def _digest(*parts) -> str:
+    return hashlib.sha1("|".join(map(str, parts)).encode()).hexdigest()[:12]
+
+
+def _run(job: ExportJob, key: str, prefix: str, build: Callable, session_factory: Callable):
+    job.status = RUNNING
+    db = session_factory()
+    tmp_path = f"{job.path}.{job.id}.part"
+    try:
+        with metrics.background(f"export_job:{job.kind}"):
+            workbook = build(db)
+            with metrics.phase("render"):
+                workbook.save(tmp_path)
+        os.replace(tmp_path, job.path)
+        job.status = DONE
+        # Older versions of the same export can never be requested again
+        directory = os.path.dirname(job.path)
+        for entry in os.listdir(directory):
+            if entry.startswith(prefix) and entry.endswith(".xlsx") and entry != os.path.basename(job.path):
+                os.remove(os.path.join(directory, entry))
+    except Exception as exc:
+        job.status, job.error = FAILED, str(exc) or exc.__class__.__name__
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    finally:
+        db.close()
+        job.finished_at = time.time()
+        with _lock:
+            _inflight.pop(key, None)
+
+
+def get(job_id: str, owner: str) -> Optional[ExportJob]:
+    job = _jobs.get(job_id)
+    if job is None or owner not in job.owners:
+        return None
+    return job
+
+
+def stats() -> dict:
+    with _lock:
+        by_status: Dict[str, int] = {}
+        for job in _jobs.values():
+            by_status[job.status] = by_status.get(job.status, 0) + 1
+        return {"workers": max(1, EXPORT_WORKERS), "jobs": by_status,
+                "inflight": len(_inflight), "cache_hits": _cache_hits}
@@ -0,0 +1,150 @@
+"""
+Flat CSV / NDJSON exports of timesheet marks and payroll, for downstream
+payroll and BI systems.
+
+Rows are read through a server-side cursor (yield_per / stream_results) and
+encoded into ~64 KB chunks as they arrive, so the response is produced in
+constant memory however many months and employees it covers. The generators
+open their own session: the request's session is closed before a
+StreamingResponse body starts.
+"""
+import calendar
+import csv
+import io
+import json
+from datetime import date
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select
+
+import models
+from database import SessionLocal
+from department_closure import in_subtree
+from department_tree import get_department_tree
+
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+YIELD_PER = 2000
+CHUNK_SIZE = 64 * 1024
+
+TIMESHEET_COLUMNS = [
+    "date", "employee_id", "tab_number", "full_name", "dept_id", "dept_name",
+    "position", "work_code", "hours_standard", "hours_night", "rate_multiplier",
+]
+
+PAYROLL_COLUMNS = [
+    "year_month", "employee_id", "tab_number", "full_name", "position", "category",
+    "dept_id", "dept_name", "service_id", "service_name", "hourly_rate",
+    "std_hours", "night_hours", "total_hours", "gross_pay",
+]
+
+
+def month_range(start: Tuple[int, int], end: Tuple[int, int]) -> List[Tuple[int, int]]:
+    """(year, month) pairs from start to end inclusive."""
+    months = []
+    year, month = start
+    while (year, month) <= end:
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def _encode(records: Iterable[Sequence], columns: List[str], fmt: str):
+    buf = io.StringIO()
+    if fmt == "csv":
+        writer = csv.writer(buf)
+        writer.writerow(columns)
+        write = writer.writerow
+    else:
+        def write(record):
+            buf.write(json.dumps(dict(zip(columns, record)), ensure_ascii=False, default=str))
+            buf.write("\n")
+    for record in records:
+        write(record)
+        if buf.tell() >= CHUNK_SIZE:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+def _stream(session_factory, fmt: str, columns: List[str], records, *args):
+    db = session_factory()
+    try:
+        yield from _encode(records(db, *args), columns, fmt)
+    finally:
+        db.close()
+
+
+def _timesheet_records(db, start_date: date, end_date: date, dept_id: Optional[int]):
+    stmt = (
+        select(
+            models.Timesheet.date,
+            models.Employee.id,
+            models.Employee.tab_number,
+            models.Employee.full_name,
+            models.Employee.dept_id,
+            models.Department.name,
+            models.Position.name,
+            models.WorkCode.code,
+            models.WorkCode.hours_standard,
+            models.WorkCode.hours_night,
+            models.WorkCode.rate_multiplier,
+        )
+        .select_from(models.Timesheet)
+        .join(models.Employee, models.Timesheet.employee_id == models.Employee.id)
+        .join(models.WorkCode, models.Timesheet.work_code_id == models.WorkCode.id)
+        .outerjoin(models.Department, models.Employee.dept_id == models.Department.id)
+        .outerjoin(models.Position, models.Employee.position_id == models.Position.id)
+        .where(models.Timesheet.date >= start_date, models.Timesheet.date <= end_date)
+        .order_by(models.Employee.id, models.Timesheet.date)
+    )
+    if dept_id is not None:
+        stmt = stmt.where(in_subtree(models.Employee.dept_id, dept_id))
+    yield from db.execute(stmt.execution_options(yield_per=YIELD_PER))
+
+
+def _payroll_records(db, months: List[Tuple[int, int]]):
+    tree = get_department_tree(db)
+    rate_map = {
+        (dept_id, position_id): rate for dept_id, position_id, rate in db.query(
+            models.SalaryRate.dept_id, models.SalaryRate.position_id, models.SalaryRate.hourly_rate
+        )
+    }
+    for year, month in months:
+        year_month = f"{year:04d}-{month:02d}"
+        _, last_day = calendar.monthrange(year, month)
+        stmt = models.payroll_hours_statement(date(year, month, 1), date(year, month, last_day))
+        for emp in db.execute(stmt.execution_options(yield_per=YIELD_PER)):
+            rate = rate_map.get((emp.dept_id, emp.position_id), 0.0)
+            dept_name = emp.dept_name or "Unknown"
+            service = tree.root_service(emp.dept_id) if emp.dept_id is not None else None
+            yield (
+                year_month, emp.employee_id, emp.tab_number, emp.full_name,
+                emp.position_name or "—",
+                emp.category if emp.category is not None else 99,
+                emp.dept_id, dept_name,
+                service.id if service else emp.dept_id,
+                service.name if service else dept_name,
+                rate,
+                round(emp.total_standard, 1), round(emp.total_night, 1),
+                round(emp.total_standard + emp.total_night, 1),
+                round(emp.weighted_hours * rate, 2),
+            )
+
+
+def stream_timesheet(fmt: str, start: Tuple[int, int], end: Tuple[int, int], dept_id: Optional[int] = None,
+                     session_factory=SessionLocal):
+    """One row per timesheet mark between the first of `start` and the end of `end`."""
+    start_date = date(start[0], start[1], 1)
+    end_date = date(end[0], end[1], calendar.monthrange(*end)[1])
+    return _stream(session_factory, fmt, TIMESHEET_COLUMNS, _timesheet_records, start_date, end_date, dept_id)
+
+
+def stream_payroll(fmt: str, start: Tuple[int, int], end: Tuple[int, int], session_factory=SessionLocal):
+    """One row per employee and month, with the same figures as GET /api/finance/payroll."""
+    return _stream(session_factory, fmt, PAYROLL_COLUMNS, _payroll_records, month_range(start, end))
@@ -0,0 +1,47 @@
+"""
+Version tokens for the timesheet grid (GET /api/timesheet/{dept_id}/{year_month}).
+
+A counter per (department, month) is bumped when a timesheet save touches that
+month, and a structure epoch is bumped when employees, positions or departments
+change. The token for a department subtree is derived from those counters and
+the in-memory department tree, so it is computed without any query.
+
+The counters live in this process: they assume a single API worker process
+(as started by the Dockerfile), or sticky routing of a department's traffic.
+"""
+import threading
+import uuid
+from typing import Dict, Iterable, Tuple
+
+_lock = threading.Lock()
+_month_versions: Dict[Tuple[int, str], int] = {}
+_epoch = 0
+# Distinguishes tokens issued before and after a restart
+_instance = uuid.uuid4().hex[:8]
+
+
+def bump_months(dept_months: Iterable[Tuple[int, str]]):
+    """Marks the given (dept_id, "YYYY-MM") pairs as changed."""
+    with _lock:
+        for key in set(dept_months):
+            _month_versions[key] = _month_versions.get(key, 0) + 1
+
+
+def bump_structure():
+    """Marks every grid as changed (employee, position or department edits)."""
+    global _epoch
+    with _lock:
+        _epoch += 1
+
+
+def subtree_version(dept_ids: Iterable[int], year_month: str) -> str:
+    # Counters only grow, so their sum changes whenever any of them does
+    total = sum(_month_versions.get((dept_id, year_month), 0) for dept_id in dept_ids)
+    return f"{_instance}-{_epoch}-{total}"
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
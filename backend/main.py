@@ -1,17 +1,38 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from sqlalchemy import extract
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import extract, delete, select, tuple_
 import models
-from database import SessionLocal, engine
+from database import (
+    SessionLocal, AsyncSessionLocal, async_read_session, dispose_async_engine, dialect_insert,
+    from_replica, note_write, read_session_factory, replica_settled,
+)
+from department_tree import get_department_tree, invalidate_department_tree
+import department_closure
+import export_jobs
+import flat_export
+import metrics
+import query_watch  # noqa: F401  (registers the SQL watchdog when SQL_* is set)
+from department_closure import in_subtree
+import grid_versions
+from month_matrix import load_month_matrix
+import month_totals
+import payroll_cache
+from principals import Principal, get_principal, invalidate_principals, principal_cache_stats
+from t13_export import (XLSX_MEDIA_TYPE, build_t13_workbook, load_t13_data, load_t13_slices, stream_workbook,
+                        write_t13_workbook)
+from t13_zip import ZIP_MEDIA_TYPE, stream_t13_zip
 from pydantic import BaseModel
 from typing import List, Optional, Dict
 from datetime import date
 import calendar
 from datetime import datetime, timedelta
 import io
+import os
+import numpy as np
 import pandas as pd
-from fastapi.responses import StreamingResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from openpyxl.utils import get_column_letter
 
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
@@ -22,11 +43,16 @@ from fastapi.middleware.cors import CORSMiddleware
 
 app = FastAPI(title="Timesheet API")
 
-from database import init_db
+import migrate
 
 @app.on_event("startup")
 def on_startup():
-    init_db()
+    # Schema changes run in migrate.py before the server starts; only the version is compared here
+    migrate.check_version()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await dispose_async_engine()
 
 # Разрешаем запросы с домена Vercel и локального хоста
 app.add_middleware(
@@ -42,6 +68,29 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def route_reads_after_writes(request: Request, call_next):
+    """Keeps a user's reads on the primary for a while after each successful write."""
+    response = await call_next(request)
+    if request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+        authorization = request.headers.get("authorization", "")
+        token = authorization[7:] if authorization.lower().startswith("bearer ") else None
+        note_write(_token_subject_or_none(token))
+    route = getattr(request.state, "db_route", None)
+    if route:
+        response.headers["X-DB-Route"] = route
+    return response
+
+# Added last so it is outermost and its timings cover the other middleware too
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.register_cache("payroll", payroll_cache.stats)
+metrics.register_cache("principal", principal_cache_stats)
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """Prometheus scrape endpoint: per-route latency, SQL and export phase metrics, cache counters."""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE_LATEST)
+
 # --- Security Config ---
 SECRET_KEY = "super-secret-key-for-mvp" # In production, use environment variable
 ALGORITHM = "HS256"
@@ -66,27 +115,6 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-# Создаем таблицы при запуске
-models.Base.metadata.create_all(bind=engine)
-
-# Inline migration: add new role permission columns if they don't exist yet
-def _run_startup_migrations():
-    new_role_cols = [
-        ("can_export", "BOOLEAN DEFAULT FALSE"),
-        ("can_manage_employees", "BOOLEAN DEFAULT FALSE"),
-        ("can_manage_users", "BOOLEAN DEFAULT FALSE"),
-        ("can_manage_departments", "BOOLEAN DEFAULT FALSE"),
-    ]
-    with engine.connect() as conn:
-        for col_name, col_def in new_role_cols:
-            try:
-                conn.execute(text(f"ALTER TABLE roles ADD COLUMN IF NOT EXISTS {col_name} {col_def}"))
-                conn.commit()
-            except Exception:
-                conn.rollback()
-
-_run_startup_migrations()
-
 # --- Pydantic Schemas ---
 class DepartmentCreate(BaseModel):
     name: str
@@ -248,24 +276,61 @@ def get_db():
     finally:
         db.close()
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
-        status_code=401,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+# Async сессия для read-heavy эндпоинтов: запросы идут через asyncpg без потока из threadpool
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+_credentials_exception = HTTPException(
+    status_code=401,
+    detail="Could not validate credentials",
+    headers={"WWW-Authenticate": "Bearer"},
+)
+
+def _token_subject_or_none(token: Optional[str]) -> Optional[str]:
+    if not token:
+        return None
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except JWTError:
+        return None
+
+# Чтение с реплики (если задана DATABASE_REPLICA_URL), кроме пользователей с недавней записью
+def get_read_db(request: Request, token: str = Depends(oauth2_scheme)):
+    db = read_session_factory(_token_subject_or_none(token))()
+    request.state.db_route = "replica" if from_replica(db) else "primary"
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_read_db(request: Request, token: str = Depends(oauth2_scheme)):
+    async with async_read_session(_token_subject_or_none(token)) as db:
+        request.state.db_route = "replica" if from_replica(db) else "primary"
+        yield db
+
+def _token_subject(token: str) -> str:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
-            raise credentials_exception
+            raise _credentials_exception
         token_data = TokenData(username=username, role=payload.get("role"), dept_id=payload.get("dept_id"))
     except JWTError:
-        raise credentials_exception
-    user = db.query(models.User).filter(models.User.username == token_data.username).first()
-    if user is None:
-        raise credentials_exception
-    return user
+        raise _credentials_exception
+    return token_data.username
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    principal = get_principal(db, _token_subject(token))
+    if principal is None:
+        raise _credentials_exception
+    return principal
+
+async def get_current_user_async(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+    principal = await db.run_sync(get_principal, _token_subject(token))
+    if principal is None:
+        raise _credentials_exception
+    return principal
 
 @app.post("/api/auth/login", response_model=Token)
 def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
@@ -306,13 +371,13 @@ def read_root():
     return {"message": "Timesheet API is running"}
 
 @app.get("/api/users", response_model=List[UserSchema])
-def get_users(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def get_users(db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
     if not current_user.role.can_manage_settings:
         raise HTTPException(status_code=403, detail="Only admins can perform this action")
-    return db.query(models.User).all()
+    return db.query(models.User).options(selectinload(models.User.role)).all()
 
 @app.post("/api/users", response_model=UserSchema)
-def create_user(user: UserCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def create_user(user: UserCreate, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
     if not current_user.role.can_manage_settings:
         raise HTTPException(status_code=403, detail="Only admins can perform this action")
     
@@ -328,7 +393,7 @@ def create_user(user: UserCreate, db: Session = Depends(get_db), current_user: m
         raise HTTPException(status_code=400, detail="Username already exists")
 
 @app.put("/api/users/{user_id}", response_model=UserSchema)
-def update_user(user_id: int, user: UserUpdate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def update_user(user_id: int, user: UserUpdate, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
     if not current_user.role.can_manage_settings:
         raise HTTPException(status_code=403, detail="Only admins can perform this action")
     
@@ -343,11 +408,12 @@ def update_user(user_id: int, user: UserUpdate, db: Session = Depends(get_db), c
             setattr(db_user, key, value)
             
     db.commit()
+    invalidate_principals()
     db.refresh(db_user)
     return db_user
 
 @app.delete("/api/users/{user_id}")
-def delete_user(user_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def delete_user(user_id: int, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
     if not current_user.role.can_manage_settings:
         raise HTTPException(status_code=403, detail="Only admins can perform this action")
         
@@ -360,16 +426,17 @@ def delete_user(user_id: int, db: Session = Depends(get_db), current_user: model
         
     db.delete(db_user)
     db.commit()
+    invalidate_principals()
     return {"status": "deleted"}
 
 @app.get("/api/roles", response_model=List[RoleSchema])
-def get_roles(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def get_roles(db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
     if not current_user.role.can_manage_settings:
         raise HTTPException(status_code=403, detail="Insufficient permissions")
     return db.query(models.Role).all()
 
 @app.post("/api/roles", response_model=RoleSchema)
-def create_role(role: RoleCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def create_role(role: RoleCreate, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
     if not current_user.role.can_manage_settings:
         raise HTTPException(status_code=403, detail="Insufficient permissions")
     db_role = models.Role(**role.dict())
@@ -379,7 +446,7 @@ def create_role(role: RoleCreate, db: Session = Depends(get_db), current_user: m
     return db_role
 
 @app.put("/api/roles/{role_id}", response_model=RoleSchema)
-def update_role(role_id: int, role: RoleUpdate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def update_role(role_id: int, role: RoleUpdate, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
     if not current_user.role.can_manage_settings:
         raise HTTPException(status_code=403, detail="Insufficient permissions")
     db_role = db.query(models.Role).filter(models.Role.id == role_id).first()
@@ -388,11 +455,12 @@ def update_role(role_id: int, role: RoleUpdate, db: Session = Depends(get_db), c
     for key, value in role.dict(exclude_unset=True).items():
         setattr(db_role, key, value)
     db.commit()
+    invalidate_principals()
     db.refresh(db_role)
     return db_role
 
 @app.delete("/api/roles/{role_id}")
-def delete_role(role_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def delete_role(role_id: int, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
     if not current_user.role.can_manage_settings:
         raise HTTPException(status_code=403, detail="Insufficient permissions")
     db_role = db.query(models.Role).filter(models.Role.id == role_id).first()
@@ -406,63 +474,71 @@ def delete_role(role_id: int, db: Session = Depends(get_db), current_user: model
         
     db.delete(db_role)
     db.commit()
+    invalidate_principals()
     return {"status": "deleted"}
 
 def _get_root_department_id(db: Session, dept_id: Optional[int]) -> Optional[int]:
-    if dept_id is None:
-        return None
-    current = db.query(models.Department).filter(models.Department.id == dept_id).first()
-    if not current:
-        return dept_id
-    while current and current.parent_id is not None:
-        parent = db.query(models.Department).filter(models.Department.id == current.parent_id).first()
-        if parent is None:
-            break
-        current = parent
-    return current.id
+    return get_department_tree(db).root_id(dept_id)
 
 @app.get("/api/departments", response_model=List[DepartmentSchema])
-def get_departments(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+async def get_departments(db: AsyncSession = Depends(get_async_read_db), current_user: Principal = Depends(get_current_user_async)):
     """Returns departments based on access rights."""
     if current_user.role.can_view_all or current_user.role.can_edit_all or current_user.role.can_manage_settings:
-        return db.query(models.Department).all()
+        return (await db.execute(select(models.Department))).scalars().all()
     
     active_dept_id = current_user.active_dept_id
     if active_dept_id is None:
         # User with no department assignment — return all visible (unscoped)
-        return db.query(models.Department).all()
+        return (await db.execute(select(models.Department))).scalars().all()
         
-    root_id = _get_root_department_id(db, active_dept_id)
-    allowed_ids = _get_department_hierarchy_ids(db, root_id)
-    return db.query(models.Department).filter(models.Department.id.in_(allowed_ids)).order_by(models.Department.category, models.Department.id).all()
+    root_id = (await db.run_sync(get_department_tree)).root_id(active_dept_id)
+    return (await db.execute(
+        select(models.Department).where(in_subtree(models.Department.id, root_id))
+        .order_by(models.Department.category, models.Department.id)
+    )).scalars().all()
 
 @app.post("/api/departments", response_model=DepartmentSchema)
-def create_department(dept: DepartmentCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def create_department(dept: DepartmentCreate, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
     can = current_user.role.can_manage_settings or (current_user.role.can_manage_departments if hasattr(current_user.role, 'can_manage_departments') else False)
     if not can:
         raise HTTPException(status_code=403, detail="Not authorized to manage departments")
     db_dept = models.Department(**dept.dict())
     db.add(db_dept)
+    db.flush()
+    department_closure.add_department(db, db_dept.id, db_dept.parent_id)
     db.commit()
+    invalidate_department_tree()
+    grid_versions.bump_structure()
+    payroll_cache.invalidate_all()
     db.refresh(db_dept)
     return db_dept
 
 @app.put("/api/departments/{dept_id}", response_model=DepartmentSchema)
-def update_department(dept_id: int, dept: DepartmentCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def update_department(dept_id: int, dept: DepartmentCreate, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
     can = current_user.role.can_manage_settings or (current_user.role.can_manage_departments if hasattr(current_user.role, 'can_manage_departments') else False)
     if not can:
         raise HTTPException(status_code=403, detail="Not authorized to manage departments")
     db_dept = db.query(models.Department).filter(models.Department.id == dept_id).first()
     if not db_dept:
         raise HTTPException(status_code=404, detail="Department not found")
+    old_parent_id = db_dept.parent_id
+    if dept.parent_id != old_parent_id and dept.parent_id is not None:
+        if department_closure.is_in_subtree(db, dept.parent_id, dept_id):
+            raise HTTPException(status_code=400, detail="Cannot move a department under itself or its sub-departments")
     for key, value in dept.dict().items():
         setattr(db_dept, key, value)
+    if dept.parent_id != old_parent_id:
+        db.flush()
+        department_closure.move_department(db, dept_id, dept.parent_id)
     db.commit()
+    invalidate_department_tree()
+    grid_versions.bump_structure()
+    payroll_cache.invalidate_all()
     db.refresh(db_dept)
     return db_dept
 
 @app.delete("/api/departments/{dept_id}")
-def delete_department(dept_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def delete_department(dept_id: int, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
     if not current_user.role.can_manage_settings:
         raise HTTPException(status_code=403, detail="Only admins can perform this action")
     db_dept = db.query(models.Department).filter(models.Department.id == dept_id).first()
@@ -479,17 +555,21 @@ def delete_department(dept_id: int, db: Session = Depends(get_db), current_user:
     if employees:
         raise HTTPException(status_code=400, detail="Cannot delete department with assigned employees")
         
+    department_closure.remove_department(db, dept_id)
     db.delete(db_dept)
     db.commit()
+    invalidate_department_tree()
+    grid_versions.bump_structure()
+    payroll_cache.invalidate_all()
     return {"status": "deleted"}
 
 # --- Positions CRUD ---
 @app.get("/api/positions", response_model=List[PositionSchema])
-def get_positions(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def get_positions(db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
     return db.query(models.Position).order_by(models.Position.name).all()
 
 @app.post("/api/positions", response_model=PositionSchema)
-def create_position(pos: PositionCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def create_position(pos: PositionCreate, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
     if not current_user.role.can_manage_settings:
         raise HTTPException(status_code=403, detail="Only admins can perform this action")
     db_pos = models.Position(**pos.dict())
@@ -503,7 +583,7 @@ def create_position(pos: PositionCreate, db: Session = Depends(get_db), current_
         raise HTTPException(status_code=400, detail="Position name must be unique")
 
 @app.put("/api/positions/{pos_id}", response_model=PositionSchema)
-def update_position(pos_id: int, pos: PositionCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def update_position(pos_id: int, pos: PositionCreate, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
     if not current_user.role.can_manage_settings:
         raise HTTPException(status_code=403, detail="Only admins can perform this action")
     db_pos = db.query(models.Position).filter(models.Position.id == pos_id).first()
@@ -511,11 +591,14 @@ def update_position(pos_id: int, pos: PositionCreate, db: Session = Depends(get_
         raise HTTPException(status_code=404, detail="Position not found")
     db_pos.name = pos.name
     db.commit()
+    # Position names are embedded in the grid's employee list
+    grid_versions.bump_structure()
+    payroll_cache.invalidate_all()
     db.refresh(db_pos)
     return db_pos
 
 @app.delete("/api/positions/{pos_id}")
-def delete_position(pos_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def delete_position(pos_id: int, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
     if not current_user.role.can_manage_settings:
         raise HTTPException(status_code=403, detail="Only admins can perform this action")
     db_pos = db.query(models.Position).filter(models.Position.id == pos_id).first()
@@ -529,12 +612,12 @@ def delete_position(pos_id: int, db: Session = Depends(get_db), current_user: mo
     return {"status": "deleted"}
 
 @app.get("/api/work-codes", response_model=List[WorkCodeSchema])
-def get_work_codes(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+async def get_work_codes(db: AsyncSession = Depends(get_async_read_db), current_user: Principal = Depends(get_current_user_async)):
     """Returns the list of available work codes (marks)."""
-    return db.query(models.WorkCode).all()
+    return (await db.execute(select(models.WorkCode))).scalars().all()
 
 @app.post("/api/work-codes", response_model=WorkCodeSchema)
-def create_work_code(wc: WorkCodeCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def create_work_code(wc: WorkCodeCreate, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
     if not current_user.role.can_manage_settings:
         raise HTTPException(status_code=403, detail="Only admins can perform this action")
     db_wc = models.WorkCode(**wc.dict())
@@ -548,16 +631,26 @@ def create_work_code(wc: WorkCodeCreate, db: Session = Depends(get_db), current_
         raise HTTPException(status_code=400, detail="Work code already exists")
 
 @app.put("/api/work-codes/{wc_id}", response_model=WorkCodeSchema)
-def update_work_code(wc_id: int, wc: WorkCodeCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def update_work_code(wc_id: int, wc: WorkCodeCreate, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
     if not current_user.role.can_manage_settings:
         raise HTTPException(status_code=403, detail="Only admins can perform this action")
     db_wc = db.query(models.WorkCode).filter(models.WorkCode.id == wc_id).first()
     if not db_wc:
         raise HTTPException(status_code=404, detail="Work code not found")
+    pay_fields = ("hours_standard", "hours_night", "rate_multiplier")
+    pay_changed = any(getattr(db_wc, key) != getattr(wc, key) for key in pay_fields)
     for key, value in wc.dict().items():
         setattr(db_wc, key, value)
     try:
+        if pay_changed:
+            # Monthly totals holding marks of this code were computed with the old hours/multiplier
+            db.flush()
+            month_totals.rebuild_work_code(db, wc_id)
         db.commit()
+        if pay_changed:
+            payroll_cache.invalidate_all()
+        # Codes and labels are printed in grids and T-13 exports, whose versions carry the epoch
+        grid_versions.bump_structure()
         db.refresh(db_wc)
         return db_wc
     except Exception:
@@ -565,18 +658,27 @@ def update_work_code(wc_id: int, wc: WorkCodeCreate, db: Session = Depends(get_d
         raise HTTPException(status_code=400, detail="Database Error updating Work Code")
 
 @app.delete("/api/work-codes/{wc_id}")
-def delete_work_code(wc_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def delete_work_code(wc_id: int, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
     if not current_user.role.can_manage_settings:
         raise HTTPException(status_code=403, detail="Only admins can perform this action")
     db_wc = db.query(models.WorkCode).filter(models.WorkCode.id == wc_id).first()
     if not db_wc:
         raise HTTPException(status_code=404, detail="Work code not found")
-    db.delete(db_wc)
-    db.commit()
+    try:
+        db.delete(db_wc)
+        db.flush()
+        # Marks left with this code no longer count towards the hours, as in the raw-row totals
+        month_totals.rebuild_work_code(db, wc_id)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Cannot delete a work code that is used in timesheets")
+    payroll_cache.invalidate_all()
+    grid_versions.bump_structure()
     return {"status": "deleted"}
 
 @app.get("/api/employees/next-tab-number")
-def get_next_tab_number(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def get_next_tab_number(db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
     """Returns the next available tab number as a zero-padded string (max existing + 1)."""
     from sqlalchemy import func
     employees = db.query(models.Employee.tab_number).all()
@@ -593,30 +695,28 @@ def get_next_tab_number(db: Session = Depends(get_db), current_user: models.User
 
 @app.get("/api/employees", response_model=List[EmployeeSchema])
 
-def get_employees(dept_id: Optional[int] = None, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+async def get_employees(dept_id: Optional[int] = None, db: AsyncSession = Depends(get_async_read_db), current_user: Principal = Depends(get_current_user_async)):
+    # Positions are loaded up front: lazy loads are not available on an AsyncSession
+    query = select(models.Employee).options(selectinload(models.Employee.position))
     is_global = current_user.role.can_view_all or current_user.role.can_edit_all or current_user.role.can_manage_settings
     if is_global:
         if dept_id:
-            allowed_ids = _get_department_hierarchy_ids(db, dept_id)
-            return db.query(models.Employee).filter(models.Employee.dept_id.in_(allowed_ids)).all()
-        return db.query(models.Employee).all()
+            query = query.where(in_subtree(models.Employee.dept_id, dept_id))
     else:
         active_dept_id = current_user.active_dept_id
-        if active_dept_id is None:
-            return db.query(models.Employee).all()
-        root_id = _get_root_department_id(db, active_dept_id)
-        if dept_id:
-            allowed_root_ids = _get_department_hierarchy_ids(db, root_id)
-            if dept_id not in allowed_root_ids:
-                return []
-            allowed_ids = _get_department_hierarchy_ids(db, dept_id)
-            return db.query(models.Employee).filter(models.Employee.dept_id.in_(allowed_ids)).all()
-        else:
-            allowed_ids = _get_department_hierarchy_ids(db, root_id)
-            return db.query(models.Employee).filter(models.Employee.dept_id.in_(allowed_ids)).all()
+        if active_dept_id is not None:
+            tree = await db.run_sync(get_department_tree)
+            root_id = tree.root_id(active_dept_id)
+            if dept_id:
+                if dept_id not in tree.descendants(root_id):
+                    return []
+                query = query.where(in_subtree(models.Employee.dept_id, dept_id))
+            else:
+                query = query.where(in_subtree(models.Employee.dept_id, root_id))
+    return (await db.execute(query)).scalars().all()
 
 @app.post("/api/employees", response_model=EmployeeSchema)
-def create_employee(emp: EmployeeCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def create_employee(emp: EmployeeCreate, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
     can = current_user.role.can_manage_settings or (current_user.role.can_manage_employees if hasattr(current_user.role, 'can_manage_employees') else False)
     if not can:
         raise HTTPException(status_code=403, detail="Not authorized to manage employees")
@@ -624,6 +724,8 @@ def create_employee(emp: EmployeeCreate, db: Session = Depends(get_db), current_
     try:
         db.add(db_emp)
         db.commit()
+        grid_versions.bump_structure()
+        payroll_cache.invalidate_all()
         db.refresh(db_emp)
         return db_emp
     except Exception:
@@ -631,7 +733,7 @@ def create_employee(emp: EmployeeCreate, db: Session = Depends(get_db), current_
         raise HTTPException(status_code=400, detail="Employee with that Tab Number might exist")
 
 @app.put("/api/employees/{emp_id}", response_model=EmployeeSchema)
-def update_employee(emp_id: int, emp: EmployeeCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def update_employee(emp_id: int, emp: EmployeeCreate, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
     can = current_user.role.can_manage_settings or (current_user.role.can_manage_employees if hasattr(current_user.role, 'can_manage_employees') else False)
     if not can:
         raise HTTPException(status_code=403, detail="Not authorized to manage employees")
@@ -641,11 +743,15 @@ def update_employee(emp_id: int, emp: EmployeeCreate, db: Session = Depends(get_
     for key, value in emp.dict().items():
         setattr(db_emp, key, value)
     db.commit()
+    # Users linked to this employee take their active department from it
+    invalidate_principals()
+    grid_versions.bump_structure()
+    payroll_cache.invalidate_all()
     db.refresh(db_emp)
     return db_emp
 
 @app.delete("/api/employees/{emp_id}")
-def delete_employee(emp_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def delete_employee(emp_id: int, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
     if not current_user.role.can_manage_settings:
         raise HTTPException(status_code=403, detail="Only admins can perform this action")
     db_emp = db.query(models.Employee).filter(models.Employee.id == emp_id).first()
@@ -657,25 +763,35 @@ def delete_employee(emp_id: int, db: Session = Depends(get_db), current_user: mo
     if timesheets:
         raise HTTPException(status_code=400, detail="Cannot delete employee with existing timesheet records")
         
+    # Without timesheet rows the employee's monthly totals are all zero
+    db.query(models.EmployeeMonthTotal).filter(models.EmployeeMonthTotal.employee_id == emp_id).delete()
     db.delete(db_emp)
     db.commit()
+    invalidate_principals()
+    grid_versions.bump_structure()
+    payroll_cache.invalidate_all()
     return {"status": "deleted"}
 
 def _get_department_hierarchy_ids(db: Session, dept_id: int) -> List[int]:
-    ids = [dept_id]
-    children = db.query(models.Department).filter(models.Department.parent_id == dept_id).all()
-    for child in children:
-        ids.extend(_get_department_hierarchy_ids(db, child.id))
-    return ids
+    return get_department_tree(db).descendants(dept_id)
 
 @app.get("/api/timesheet/{dept_id}/{year_month}")
-def get_timesheet(dept_id: int, year_month: str, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+async def get_timesheet(dept_id: int, year_month: str, request: Request, response: Response,
+                        fmt: Optional[str] = Query(None, alias="format"),
+                        db: AsyncSession = Depends(get_async_read_db), current_user: Principal = Depends(get_current_user_async)):
     """
     Returns a grid-ready JSON containing employees and their existing marks for the specified month.
     year_month format: YYYY-MM
+    ?format=columnar returns parallel arrays instead (see _get_timesheet_columnar).
+    The response carries a strong ETag; a matching If-None-Match is answered with 304
+    before any employee or timesheet query runs.
     """
+    if fmt not in (None, "columnar"):
+        raise HTTPException(status_code=400, detail="Unsupported format. Expected 'columnar'")
+
+    tree = await db.run_sync(get_department_tree)
     if not current_user.role.can_view_all and not current_user.role.can_edit_all:
-        allowed_dept_ids = _get_department_hierarchy_ids(db, current_user.active_dept_id)
+        allowed_dept_ids = tree.descendants(current_user.active_dept_id)
         if dept_id not in allowed_dept_ids:
             raise HTTPException(status_code=403, detail="Not authorized to view this department's timesheet")
 
@@ -685,27 +801,47 @@ def get_timesheet(dept_id: int, year_month: str, db: Session = Depends(get_db),
         raise HTTPException(status_code=400, detail="Invalid month format. Expected YYYY-MM")
 
     # 1. Get employees in the department and sub-departments
-    dept_ids = _get_department_hierarchy_ids(db, dept_id)
-    employees = db.query(models.Employee).filter(models.Employee.dept_id.in_(dept_ids)).all()
+    dept_ids = tree.descendants(dept_id)
+
+    # Taken before reading so a save that lands mid-read yields a newer token next time
+    etag = f'"{grid_versions.subtree_version(dept_ids, f"{year:04d}-{month:02d}")}-{fmt or "nested"}"'
+    cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if grid_versions.etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=cache_headers)
+    if from_replica(db) and not replica_settled():
+        # The replica may still lag behind the write that produced this token
+        cache_headers = {"Cache-Control": "no-store"}
+    if fmt == "columnar":
+        return JSONResponse(await db.run_sync(_get_timesheet_columnar, dept_id, year, month), headers=cache_headers)
+    response.headers.update(cache_headers)
+
+    employees = (await db.execute(
+        select(models.Employee).options(selectinload(models.Employee.position))
+        .where(in_subtree(models.Employee.dept_id, dept_id))
+    )).scalars().all()
     emp_dict = [EmployeeSchema.from_orm(emp).dict() for emp in employees]
-    emp_ids = [emp.id for emp in employees]
 
     # 2. Get timesheet entries for these employees for this month
     start_date = date(year, month, 1)
     _, last_day = calendar.monthrange(year, month)
     end_date = date(year, month, last_day)
 
-    entries = db.query(models.Timesheet).filter(
-        models.Timesheet.employee_id.in_(emp_ids),
-        models.Timesheet.date >= start_date,
-        models.Timesheet.date <= end_date
-    ).all()
+    entries = (await db.execute(
+        select(models.Timesheet.employee_id, models.Timesheet.date, models.Timesheet.work_code_id)
+        .join(models.Employee, models.Timesheet.employee_id == models.Employee.id)
+        .where(
+            in_subtree(models.Employee.dept_id, dept_id),
+            models.Timesheet.date >= start_date,
+            models.Timesheet.date <= end_date
+        )
+    )).all()
 
     # 3. Format as nested dictionary: employee_id -> day -> work_code_id
     timesheet_data = {emp.id: {} for emp in employees}
-    for entry in entries:
-        day = entry.date.day
-        timesheet_data[entry.employee_id][day] = entry.work_code_id
+    for employee_id, entry_date, work_code_id in entries:
+        # Skip employees moved into the subtree between the two reads
+        if employee_id in timesheet_data:
+            timesheet_data[employee_id][entry_date.day] = work_code_id
 
     return {
         "employees": emp_dict,
@@ -715,8 +851,60 @@ def get_timesheet(dept_id: int, year_month: str, db: Session = Depends(get_db),
         "year": year
     }
 
+def _get_timesheet_columnar(db: Session, dept_id: int, year: int, month: int) -> dict:
+    """
+    Columnar grid payload: employee fields as parallel arrays, and one row of
+    days_in_month small ints per employee. A mark is an index into work_code_ids
+    (0 = no mark), so the month needs no per-cell dicts or stringified keys.
+    """
+    _, last_day = calendar.monthrange(year, month)
+    employees = db.query(
+        models.Employee.id,
+        models.Employee.full_name,
+        models.Employee.tab_number,
+        models.Employee.category,
+        models.Employee.position_id,
+        models.Position.name,
+        models.Employee.dept_id,
+    ).outerjoin(models.Position, models.Employee.position_id == models.Position.id).filter(
+        in_subtree(models.Employee.dept_id, dept_id)
+    ).order_by(models.Employee.id).all()
+    ids, full_names, tab_numbers, categories, position_ids, position_names, emp_dept_ids = (
+        [list(column) for column in zip(*employees)] if employees else [[] for _ in range(7)]
+    )
+
+    # The matrix re-reads the subtree; rows of employees moved in or out between
+    # the two reads are dropped or left without marks
+    matrix = load_month_matrix(db, year, month, dept_id)
+    codes = np.zeros((len(ids), last_day), dtype=np.int16)
+    if len(matrix.employee_ids) and ids:
+        emp_ids = np.array(ids, dtype=np.int64)
+        rows = np.searchsorted(matrix.employee_ids, emp_ids)
+        known = (rows < len(matrix.employee_ids)) & \
+            (matrix.employee_ids[np.minimum(rows, len(matrix.employee_ids) - 1)] == emp_ids)
+        codes[known] = matrix.codes[rows[known]]
+    work_code_ids = [None] + matrix.work_code_ids[1:].tolist()
+
+    return {
+        "format": "columnar",
+        "employees": {
+            "id": ids,
+            "full_name": full_names,
+            "tab_number": tab_numbers,
+            "category": categories,
+            "position_id": position_ids,
+            "position_name": position_names,
+            "dept_id": emp_dept_ids,
+        },
+        "work_code_ids": work_code_ids,
+        "codes": codes.tolist(),
+        "days_in_month": last_day,
+        "month": month,
+        "year": year
+    }
+
 @app.get("/api/export/t13/{dept_id}/{year_month}")
-def export_t13(dept_id: int, year_month: str, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def export_t13(dept_id: int, year_month: str, db: Session = Depends(get_read_db), current_user: Principal = Depends(get_current_user)):
     """Exports Timesheet to Excel T-13 Format with Department Grouping"""
     if not current_user.role.can_view_all and not current_user.role.can_edit_all and not current_user.role.can_view_only:
         allowed_dept_ids = _get_department_hierarchy_ids(db, current_user.active_dept_id)
@@ -728,217 +916,207 @@ def export_t13(dept_id: int, year_month: str, db: Session = Depends(get_db), cur
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid month format. Expected YYYY-MM")
 
-    department = db.query(models.Department).filter(models.Department.id == dept_id).first()
-    if not department:
+    tree = get_department_tree(db)
+    if dept_id not in tree.nodes:
         raise HTTPException(status_code=404, detail="Department not found")
 
-    dept_ids = _get_department_hierarchy_ids(db, dept_id)
-    departments = db.query(models.Department).filter(models.Department.id.in_(dept_ids)).all()
-    employees = db.query(models.Employee).filter(models.Employee.dept_id.in_(dept_ids)).all()
-    emp_ids = [emp.id for emp in employees]
+    with metrics.phase("compute"):
+        data = load_t13_data(db, tree, dept_id, year, month)
 
-    _, last_day = calendar.monthrange(year, month)
-    start_date = date(year, month, 1)
-    end_date = date(year, month, last_day)
-
-    entries = db.query(models.Timesheet).filter(
-        models.Timesheet.employee_id.in_(emp_ids),
-        models.Timesheet.date >= start_date,
-        models.Timesheet.date <= end_date
-    ).all()
-
-    work_codes = {wc.id: wc for wc in db.query(models.WorkCode).all()}
-    
-    # Timesheet Map: emp.id -> day -> wc
-    timesheet_map = {emp.id: {} for emp in employees}
-    for entry in entries:
-        timesheet_map[entry.employee_id][entry.date.day] = work_codes.get(entry.work_code_id)
-
-    # Calculate employee totals
-    totals = {}
-    for emp in employees:
-        std = 0.0
-        night = 0.0
-        for day in range(1, last_day + 1):
-            wc = timesheet_map[emp.id].get(day)
-            if wc:
-                std += (wc.hours_standard or 0.0)
-                night += (wc.hours_night or 0.0)
-        totals[emp.id] = {"std": round(std, 1), "night": round(night, 1), "total": round(std + night, 1)}
-
-    # Group employees by department for rendering
-    depts_map = {d.id: d for d in departments}
-    
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
     from urllib.parse import quote
-    
-    wb = Workbook()
-    ws = wb.active
-    ws.title = f"Timesheet {year_month}"
-    
-    thin = Side(style="thin")
-    border = Border(left=thin, right=thin, top=thin, bottom=thin)
-    
-    # Header Font and Fill
-    hf = Font(bold=True, color="1E293B")
-    hfill = PatternFill(fill_type="solid", fgColor="F8FAFC")
-    
-    # Headers
-    hdrs = ["Employee Name", "Tab No.", "Position", "Category"]
-    for day in range(1, last_day + 1):
-        hdrs.append(str(day))
-    hdrs.extend(["Std Hrs", "Night Hrs", "Total Hrs"])
-    
-    ws.append(hdrs)
-    for c in range(1, len(hdrs) + 1):
-        cell = ws.cell(row=1, column=c)
-        cell.font = hf
-        cell.fill = hfill
-        cell.alignment = Alignment(horizontal="center", vertical="center")
-        cell.border = border
-
-    # Process Departments Top-Down
-    # Sort departments by category, then by ID
-    sorted_depts = sorted(departments, key=lambda d: (d.category or 99, d.id))
-    
-    current_row = 2
-    
-    for dept in sorted_depts:
-        dept_emps = [e for e in employees if e.dept_id == dept.id]
-        if not dept_emps:
-            continue
-            
-        # Draw Department Banner
-        dept_cell = ws.cell(row=current_row, column=1)
-        
-        parent_name = ""
-        if dept.parent_id and dept.parent_id in depts_map:
-            parent_name = f"{depts_map[dept.parent_id].name} » "
-            
-        dept_cell.value = f"{parent_name}{dept.name}"
-        dept_cell.font = Font(bold=True, color="0F172A")
-        dept_cell.fill = PatternFill(fill_type="solid", fgColor="E2E8F0")
-        
-        # Merge department banner across all columns
-        ws.merge_cells(start_row=current_row, start_column=1, end_row=current_row, end_column=len(hdrs))
-        # Apply borders to merged cell
-        for c in range(1, len(hdrs) + 1):
-            ws.cell(row=current_row, column=c).border = border
-            
-        current_row += 1
-        
-        # Draw Employees
-        dept_emps.sort(key=lambda e: (e.category or 99, e.full_name))
-        for emp in dept_emps:
-            pos_name = emp.position.name if emp.position else "—"
-            cat_name = str(emp.category) if emp.category is not None else "99"
-            row_data = [emp.full_name, emp.tab_number, pos_name, cat_name]
-            
-            for day in range(1, last_day + 1):
-                wc = timesheet_map[emp.id].get(day)
-                row_data.append(wc.code if wc else "")
-                
-            emp_totals = totals[emp.id]
-            row_data.extend([emp_totals["std"], emp_totals["night"], emp_totals["total"]])
-            
-            for c_idx, val in enumerate(row_data, 1):
-                cell = ws.cell(row=current_row, column=c_idx)
-                cell.value = val
-                cell.border = border
-                if c_idx > 4:  # Center align days and totals
-                    cell.alignment = Alignment(horizontal="center")
-                    
-            current_row += 1
-
-    # Adjust Column Widths
-    ws.column_dimensions['A'].width = 30
-    ws.column_dimensions['B'].width = 12
-    ws.column_dimensions['C'].width = 20
-    ws.column_dimensions['D'].width = 10
-    for day in range(1, last_day + 1):
-        ws.column_dimensions[get_column_letter(day + 4)].width = 5
-    for c in range(1, 4):
-        ws.column_dimensions[get_column_letter(last_day + 4 + c)].width = 10
-
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-    
-    filename = f"T-13_{department.full_name.replace(' ', '_').replace('»', '-')}_{year_month}.xlsx"
+
+    full_name = tree.full_name(dept_id)
+    filename = f"T-13_{full_name.replace(' ', '_').replace('»', '-')}_{year_month}.xlsx"
     encoded_filename = quote(filename)
-    
+
     return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        stream_workbook(lambda sink: write_t13_workbook(data, sink)),
+        media_type=XLSX_MEDIA_TYPE,
         headers={"Content-Disposition": f"attachment; filename*=utf-8''{encoded_filename}"}
     )
 
+@app.get("/api/export/t13-zip/{year_month}")
+def export_t13_zip(year_month: str, dept_id: List[int] = Query(None),
+                   db: Session = Depends(get_read_db), current_user: Principal = Depends(get_current_user)):
+    """
+    Exports one T-13 workbook per department subtree as a ZIP archive.
+    Defaults to every top-level service; ?dept_id=...&dept_id=... picks the subtrees.
+    Workbooks are rendered in parallel in a process pool and streamed as they finish.
+    """
+    try:
+        year, month = map(int, year_month.split("-"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid month format. Expected YYYY-MM")
+
+    tree = get_department_tree(db)
+    is_global = current_user.role.can_view_all or current_user.role.can_edit_all or current_user.role.can_view_only
+    if dept_id:
+        dept_ids = list(dict.fromkeys(dept_id))
+    elif is_global or current_user.active_dept_id is None:
+        dept_ids = tree.top_services()
+    else:
+        dept_ids = [current_user.active_dept_id]
+    missing = [did for did in dept_ids if did not in tree.nodes]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Department not found: {missing}")
+    if not is_global:
+        allowed_dept_ids = set(_get_department_hierarchy_ids(db, current_user.active_dept_id))
+        if any(did not in allowed_dept_ids for did in dept_ids):
+            raise HTTPException(status_code=403, detail="Not authorized to export this department's timesheet")
+
+    with metrics.phase("compute"):
+        slices = load_t13_slices(db, tree, dept_ids, year, month)
+    items = []
+    for did, data in zip(dept_ids, slices):
+        full_name = tree.full_name(did)
+        items.append((f"T-13_{full_name.replace(' ', '_').replace('»', '-')}_{year_month}.xlsx", data))
+
+    return StreamingResponse(
+        stream_t13_zip(items),
+        media_type=ZIP_MEDIA_TYPE,
+        headers={"Content-Disposition": f"attachment; filename=T-13_{year_month}.zip"}
+    )
+
+def _parse_flat_range(fmt: str, start: str, end: Optional[str]):
+    if fmt not in flat_export.MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Unsupported format. Expected 'csv' or 'ndjson'")
+    try:
+        first = tuple(map(int, start.split("-")))
+        last = tuple(map(int, (end or start).split("-")))
+        date(*first, 1), date(*last, 1)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid month format. Expected YYYY-MM")
+    if last < first:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+    return first, last
+
+@app.get("/api/export/flat/timesheet")
+def export_timesheet_flat(start: str, end: Optional[str] = None, dept_id: Optional[int] = None,
+                          fmt: str = Query("csv", alias="format"),
+                          db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
+    """
+    Streams one row per timesheet mark from month `start` through `end` (YYYY-MM)
+    as CSV or NDJSON. Without dept_id the whole organisation is exported.
+    """
+    first, last = _parse_flat_range(fmt, start, end)
+    if not current_user.role.can_view_all and not current_user.role.can_edit_all and not current_user.role.can_view_only:
+        if dept_id is None:
+            dept_id = current_user.active_dept_id
+        allowed_dept_ids = _get_department_hierarchy_ids(db, current_user.active_dept_id)
+        if dept_id not in allowed_dept_ids:
+            raise HTTPException(status_code=403, detail="Not authorized to export this department's timesheet")
+    period = f"{first[0]:04d}-{first[1]:02d}_{last[0]:04d}-{last[1]:02d}"
+    return StreamingResponse(
+        flat_export.stream_timesheet(fmt, first, last, dept_id, read_session_factory(current_user.username)),
+        media_type=flat_export.MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f"attachment; filename=timesheet_{period}.{fmt}"}
+    )
+
 @app.post("/api/timesheet/update")
-def update_timesheet(payload: TimesheetUpdateRequest, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def update_timesheet(payload: TimesheetUpdateRequest, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_user)):
     """Bulk update endpoint to save changes from the grid."""
     
-    # Optional Security: For the MVP, we assume the frontend sends Employee IDs within the user's allowed department.
-    # In a full app, we would query the Employee IDs and verify all belong to current_user.dept_id.
+    # Resolve every distinct employee in the payload with one query; the departments
+    # drive both the permission check and the grid version bump after the save.
+    # The rows stay locked until commit so concurrent saves for the same employees
+    # can't interleave their monthly rollup updates.
+    employee_ids = {item.employee_id for item in payload.updates}
+    employee_depts = dict(db.query(models.Employee.id, models.Employee.dept_id).filter(
+        models.Employee.id.in_(employee_ids)
+    ).order_by(models.Employee.id).with_for_update().all()) if employee_ids else {}
+
+    # Reject the whole batch if any employee is outside the user's department subtree
     if not current_user.role.can_edit_all:
-        allowed_dept_ids = _get_department_hierarchy_ids(db, current_user.active_dept_id)
-        for item in payload.updates:
-            emp = db.query(models.Employee).get(item.employee_id)
-            if emp and emp.dept_id not in allowed_dept_ids:
-                raise HTTPException(status_code=403, detail="Cannot edit employees outside your department")
-    
+        allowed_dept_ids = set(_get_department_hierarchy_ids(db, current_user.active_dept_id))
+        forbidden = sorted(emp_id for emp_id, dept in employee_depts.items() if dept not in allowed_dept_ids)
+        if forbidden:
+            raise HTTPException(
+                status_code=403,
+                detail=f"Cannot edit employees outside your department: {', '.join(map(str, forbidden))}"
+            )
+
+    # Collapse the payload to the last value sent for each (employee, date) cell
+    cells = {}
     for item in payload.updates:
-        # Check if entry exists
-        existing = db.query(models.Timesheet).filter(
-            models.Timesheet.employee_id == item.employee_id,
-            models.Timesheet.date == item.date
-        ).first()
-
-        if item.work_code_id is None:
-            # Delete entry if exists
-            if existing:
-                db.delete(existing)
-        else:
-            if existing:
-                # Update
-                existing.work_code_id = item.work_code_id
-            else:
-                # Insert
-                new_entry = models.Timesheet(
-                    employee_id=item.employee_id,
-                    date=item.date,
-                    work_code_id=item.work_code_id
-                )
-                db.add(new_entry)
-                
+        cells[(item.employee_id, item.date)] = item.work_code_id
+    assignments = [
+        {"employee_id": emp_id, "date": day, "work_code_id": wc_id}
+        for (emp_id, day), wc_id in cells.items() if wc_id is not None
+    ]
+    cleared = [key for key, wc_id in cells.items() if wc_id is None]
+
+    # Current codes of the touched cells: classify inserts vs updates and feed the rollup
+    existing = {}
+    if cells:
+        dates = [day for _, day in cells]
+        rows = db.query(
+            models.Timesheet.employee_id, models.Timesheet.date, models.Timesheet.work_code_id
+        ).filter(
+            models.Timesheet.employee_id.in_({emp_id for emp_id, _ in cells}),
+            models.Timesheet.date >= min(dates),
+            models.Timesheet.date <= max(dates)
+        ).all()
+        existing = {
+            (row.employee_id, row.date): row.work_code_id
+            for row in rows if (row.employee_id, row.date) in cells
+        }
+
+    if assignments:
+        stmt = dialect_insert(db)(models.Timesheet)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[models.Timesheet.employee_id, models.Timesheet.date],
+            set_={"work_code_id": stmt.excluded.work_code_id}
+        )
+        db.execute(stmt, assignments)
+
+    deleted = 0
+    if cleared:
+        result = db.execute(
+            delete(models.Timesheet).where(
+                tuple_(models.Timesheet.employee_id, models.Timesheet.date).in_(cleared)
+            )
+        )
+        deleted = result.rowcount
+
+    month_totals.apply_timesheet_changes(
+        db, ((emp_id, day, existing.get((emp_id, day)), wc_id) for (emp_id, day), wc_id in cells.items())
+    )
     db.commit()
-    return {"status": "success", "updated_count": len(payload.updates)}
+    grid_versions.bump_months(
+        (employee_depts[emp_id], f"{day:%Y-%m}") for emp_id, day in cells if emp_id in employee_depts
+    )
+    payroll_cache.invalidate_months(f"{day:%Y-%m}" for _, day in cells)
+    updated = sum(1 for row in assignments if (row["employee_id"], row["date"]) in existing)
+    return {
+        "status": "success",
+        "updated_count": len(payload.updates),
+        "inserted": len(assignments) - updated,
+        "updated": updated,
+        "deleted": deleted,
+    }
+
 # ============================================================
 # FINANCE MODULE — appended by migrate script
 # ============================================================
 
-def _require_finance_view(current_user: models.User = Depends(get_current_user)):
+def _require_finance_view(current_user: Principal = Depends(get_current_user)):
     if not getattr(current_user.role, 'can_view_finance', False) and not current_user.role.can_manage_settings and not current_user.role.can_view_all and not current_user.role.can_edit_all:
         raise HTTPException(status_code=403, detail="Finance access required")
     return current_user
 
-def _require_finance_edit(current_user: models.User = Depends(get_current_user)):
+async def _require_finance_view_async(current_user: Principal = Depends(get_current_user_async)):
+    return _require_finance_view(current_user)
+
+def _require_finance_edit(current_user: Principal = Depends(get_current_user)):
     if not getattr(current_user.role, 'can_edit_finance', False) and not current_user.role.can_manage_settings and not current_user.role.can_edit_all:
         raise HTTPException(status_code=403, detail="Finance edit permission required")
     return current_user
 
 def _get_root_service(db: Session, dept_id: int):
-    """Climbs up the department tree to find the first ancestor with category=1 (Service)."""
-    current_dept = db.query(models.Department).filter(models.Department.id == dept_id).first()
-    while current_dept:
-        if current_dept.category == 1:
-            return current_dept
-        if current_dept.parent_id is None:
-            break
-        current_dept = db.query(models.Department).filter(models.Department.id == current_dept.parent_id).first()
-    return None
-
-def _write_audit(db: Session, user: models.User, action: str, target: str,
+    """Finds the first ancestor with category=1 (Service) in the department tree index."""
+    return get_department_tree(db).root_service(dept_id)
+
+def _write_audit(db: Session, user: Principal, action: str, target: str,
                  old_value: str = None, new_value: str = None):
     log = models.FinanceAuditLog(
         user_id=user.id, action=action, target=target,
@@ -950,10 +1128,11 @@ def _write_audit(db: Session, user: models.User, action: str, target: str,
 
 @app.get("/api/salary-rates")
 def get_salary_rates(db: Session = Depends(get_db),
-                     current_user: models.User = Depends(_require_finance_view)):
-    rates = db.query(models.SalaryRate).all()
+                     current_user: Principal = Depends(_require_finance_view)):
+    rates = db.query(models.SalaryRate).options(selectinload(models.SalaryRate.position)).all()
+    tree = get_department_tree(db)
     return [{"id": r.id, "dept_id": r.dept_id,
-             "dept_name": r.department.full_name if r.department else None,
+             "dept_name": tree.full_name(r.dept_id) if r.dept_id in tree.nodes else None,
              "position_id": r.position_id,
              "position_name": r.position.name if r.position else None,
              "hourly_rate": r.hourly_rate} for r in rates]
@@ -961,7 +1140,7 @@ def get_salary_rates(db: Session = Depends(get_db),
 
 @app.post("/api/salary-rates")
 def upsert_salary_rate(rate: SalaryRateCreate, db: Session = Depends(get_db),
-                       current_user: models.User = Depends(_require_finance_edit)):
+                       current_user: Principal = Depends(_require_finance_edit)):
     existing = db.query(models.SalaryRate).filter(
         models.SalaryRate.dept_id == rate.dept_id,
         models.SalaryRate.position_id == rate.position_id
@@ -974,6 +1153,7 @@ def upsert_salary_rate(rate: SalaryRateCreate, db: Session = Depends(get_db),
         existing.hourly_rate = rate.hourly_rate
         _write_audit(db, current_user, "UPDATE_RATE", target, old_val, str(rate.hourly_rate))
         db.commit()
+        payroll_cache.invalidate_all()
         db.refresh(existing)
         r = existing
     else:
@@ -981,13 +1161,14 @@ def upsert_salary_rate(rate: SalaryRateCreate, db: Session = Depends(get_db),
         db.add(r)
         _write_audit(db, current_user, "CREATE_RATE", target, None, str(rate.hourly_rate))
         db.commit()
+        payroll_cache.invalidate_all()
         db.refresh(r)
     return {"id": r.id, "dept_id": r.dept_id, "position_id": r.position_id, "hourly_rate": r.hourly_rate}
 
 
 @app.delete("/api/salary-rates/{rate_id}")
 def delete_salary_rate(rate_id: int, db: Session = Depends(get_db),
-                       current_user: models.User = Depends(_require_finance_edit)):
+                       current_user: Principal = Depends(_require_finance_edit)):
     r = db.query(models.SalaryRate).filter(models.SalaryRate.id == rate_id).first()
     if not r:
         raise HTTPException(status_code=404, detail="Rate not found")
@@ -995,50 +1176,53 @@ def delete_salary_rate(rate_id: int, db: Session = Depends(get_db),
     _write_audit(db, current_user, "DELETE_RATE", target, str(r.hourly_rate), None)
     db.delete(r)
     db.commit()
+    payroll_cache.invalidate_all()
     return {"status": "deleted"}
 
 
 @app.get("/api/finance/payroll/{year_month}")
-def get_payroll(year_month: str, db: Session = Depends(get_db),
-                current_user: models.User = Depends(_require_finance_view)):
+async def get_payroll(year_month: str, db: AsyncSession = Depends(get_async_read_db),
+                      current_user: Principal = Depends(_require_finance_view_async)):
+    with metrics.phase("compute"):
+        return await db.run_sync(_load_payroll, year_month)
+
+
+def _load_payroll(db: Session, year_month: str) -> dict:
+    """Payroll for one month, served from payroll_cache when it is still current."""
     try:
         year, month = map(int, year_month.split("-"))
     except ValueError:
         raise HTTPException(status_code=400, detail="year_month must be YYYY-MM")
+    cache_key = f"{year:04d}-{month:02d}"
+    cached = payroll_cache.get(cache_key)
+    if cached is not None:
+        return {**cached, "year_month": year_month}
+    cache_version = payroll_cache.month_version(cache_key)
+    # A lagging replica must not fill the cache under the current version
+    cacheable = not from_replica(db) or replica_settled()
+
     _, days = calendar.monthrange(year, month)
     month_start = date(year, month, 1)
     month_end = date(year, month, days)
     rates = db.query(models.SalaryRate).all()
     rate_map = {(r.dept_id, r.position_id): r.hourly_rate for r in rates}
-    employees = db.query(models.Employee).all()
+    totals = models.calculate_payroll_hours(db, month_start, month_end)
     rows = []
     dept_totals: Dict[int, dict] = {}
-    for emp in employees:
-        entries = db.query(models.Timesheet).filter(
-            models.Timesheet.employee_id == emp.id,
-            models.Timesheet.date >= month_start,
-            models.Timesheet.date <= month_end,
-        ).all()
+    for emp in totals:
         rate = rate_map.get((emp.dept_id, emp.position_id), 0.0)
-        total_std = 0.0
-        total_night = 0.0
-        gross_pay = 0.0
-        for entry in entries:
-            wc = db.query(models.WorkCode).get(entry.work_code_id)
-            if wc:
-                m = wc.rate_multiplier or 1.0
-                total_std += wc.hours_standard
-                total_night += wc.hours_night
-                gross_pay += (wc.hours_standard + wc.hours_night) * rate * m
-        dept_name = emp.department.name if emp.department else "Unknown"
+        total_std = emp.total_standard
+        total_night = emp.total_night
+        gross_pay = emp.weighted_hours * rate
+        dept_name = emp.dept_name or "Unknown"
         service = _get_root_service(db, emp.dept_id)
         service_name = service.name if service else dept_name
         service_id = service.id if service else emp.dept_id
 
-        pos_name = emp.position.name if emp.position else "—"
+        pos_name = emp.position_name or "—"
         pos_category = emp.category if emp.category is not None else 99
         rows.append({
-            "employee_id": emp.id, "full_name": emp.full_name,
+            "employee_id": emp.employee_id, "full_name": emp.full_name,
             "tab_number": emp.tab_number, "position": pos_name,
             "category": pos_category,
             "dept_id": emp.dept_id, "dept_name": dept_name,
@@ -1058,20 +1242,34 @@ def get_payroll(year_month: str, db: Session = Depends(get_db),
     dept_summary = [{"dept_id": did, **info, "total_pay": round(info["total_pay"], 2)}
                     for did, info in dept_totals.items()]
     top = max(dept_summary, key=lambda x: x["total_pay"]) if dept_summary else None
-    return {
+    result = {
         "year_month": year_month, "employees": rows, "dept_summary": dept_summary,
         "grand_total": round(grand_total, 2), "avg_salary": avg_salary,
         "top_dept": top["dept_name"] if top else None,
         "top_dept_pay": round(top["total_pay"], 2) if top else 0.0,
     }
+    if cacheable:
+        payroll_cache.put(cache_key, result, cache_version)
+    return result
 
 
 @app.get("/api/finance/payroll/{year_month}/export")
-def export_payroll_excel(year_month: str, db: Session = Depends(get_db),
-                         current_user: models.User = Depends(_require_finance_view)):
+def export_payroll_excel(year_month: str, db: Session = Depends(get_read_db),
+                         current_user: Principal = Depends(_require_finance_view)):
+    with metrics.phase("compute"):
+        payroll = _load_payroll(db, year_month)
+    with metrics.phase("render"):
+        wb = _build_payroll_workbook(payroll, year_month)
+        buf = io.BytesIO()
+        wb.save(buf); buf.seek(0)
+    return StreamingResponse(buf,
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers={"Content-Disposition": f"attachment; filename=payroll_{year_month}.xlsx"})
+
+
+def _build_payroll_workbook(payroll: dict, year_month: str):
     from openpyxl import Workbook
     from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-    payroll = get_payroll(year_month, db, current_user)
     wb = Workbook()
     ws = wb.active
     ws.title = f"Payroll {year_month}"
@@ -1120,17 +1318,128 @@ def export_payroll_excel(year_month: str, db: Session = Depends(get_db),
     tc.fill = PatternFill(fill_type="solid", fgColor="C7D2FE")
     for c, w in enumerate([4, 10, 28, 20, 20, 10, 9, 10, 10, 14], 1):
         ws.column_dimensions[get_column_letter(c)].width = w
-    buf = io.BytesIO()
-    wb.save(buf); buf.seek(0)
-    return StreamingResponse(buf,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename=payroll_{year_month}.xlsx"})
+    return wb
+
+
+@app.get("/api/export/flat/payroll")
+def export_payroll_flat(start: str, end: Optional[str] = None, fmt: str = Query("csv", alias="format"),
+                        current_user: Principal = Depends(_require_finance_view)):
+    """Streams one payroll row per employee and month from `start` through `end` as CSV or NDJSON."""
+    first, last = _parse_flat_range(fmt, start, end)
+    period = f"{first[0]:04d}-{first[1]:02d}_{last[0]:04d}-{last[1]:02d}"
+    return StreamingResponse(
+        flat_export.stream_payroll(fmt, first, last, read_session_factory(current_user.username)),
+        media_type=flat_export.MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f"attachment; filename=payroll_{period}.{fmt}"}
+    )
+
+
+# --- Export jobs ---
+class ExportJobRequest(BaseModel):
+    kind: str                       # "t13" or "payroll"
+    year_month: str
+    dept_id: Optional[int] = None   # required for t13
+
+
+@app.post("/api/export/jobs", status_code=202)
+def create_export_job(payload: ExportJobRequest, db: Session = Depends(get_db),
+                      current_user: Principal = Depends(get_current_user)):
+    """
+    Queues an export on the export worker pool and returns the job.
+    A result already cached for the same data version is returned as done.
+    """
+    try:
+        year, month = map(int, payload.year_month.split("-"))
+        year_month = f"{year:04d}-{month:02d}"
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid month format. Expected YYYY-MM")
+
+    if payload.kind == "t13":
+        dept_id = payload.dept_id
+        if dept_id is None:
+            raise HTTPException(status_code=400, detail="dept_id is required for T-13 exports")
+        if not current_user.role.can_view_all and not current_user.role.can_edit_all and not current_user.role.can_view_only:
+            if dept_id not in _get_department_hierarchy_ids(db, current_user.active_dept_id):
+                raise HTTPException(status_code=403, detail="Not authorized to export this department's timesheet")
+        tree = get_department_tree(db)
+        if dept_id not in tree.nodes:
+            raise HTTPException(status_code=404, detail="Department not found")
+        # Marks and work-code labels move the grid version (edits to codes bump its structure epoch),
+        # hours and multipliers the payroll version
+        version = f"{grid_versions.subtree_version(tree.descendants(dept_id), year_month)}/{payroll_cache.month_version(year_month)}"
+        full_name = tree.full_name(dept_id)
+        filename = f"T-13_{full_name.replace(' ', '_').replace('»', '-')}_{year_month}.xlsx"
+
+        def build(job_db):
+            job_tree = get_department_tree(job_db)
+            with metrics.phase("compute"):
+                data = load_t13_data(job_db, job_tree, dept_id, year, month)
+            with metrics.phase("render"):
+                return build_t13_workbook(data)
+        scope = str(dept_id)
+    elif payload.kind == "payroll":
+        _require_finance_view(current_user)
+        version = str(payroll_cache.month_version(year_month))
+        filename = f"payroll_{year_month}.xlsx"
+
+        def build(job_db):
+            with metrics.phase("compute"):
+                payroll = _load_payroll(job_db, year_month)
+            with metrics.phase("render"):
+                return _build_payroll_workbook(payroll, year_month)
+        scope = "all"
+    else:
+        raise HTTPException(status_code=400, detail="Unsupported export kind. Expected 't13' or 'payroll'")
+
+    # Results are cached under `version`, so the replica is used only once it has caught up
+    session_factory = read_session_factory(current_user.username) if replica_settled() else SessionLocal
+    job = export_jobs.submit(payload.kind, scope, year_month, version, filename, build, current_user.username,
+                             session_factory)
+    return job.to_dict()
+
+
+@app.get("/api/export/jobs/{job_id}")
+def get_export_job(job_id: str, current_user: Principal = Depends(get_current_user)):
+    job = export_jobs.get(job_id, current_user.username)
+    if not job:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    return job.to_dict()
+
+
+@app.get("/api/export/jobs/{job_id}/download")
+def download_export_job(job_id: str, current_user: Principal = Depends(get_current_user)):
+    from urllib.parse import quote
+
+    job = export_jobs.get(job_id, current_user.username)
+    if not job:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    if job.status == export_jobs.FAILED:
+        raise HTTPException(status_code=500, detail=f"Export failed: {job.error}")
+    if job.status != export_jobs.DONE:
+        raise HTTPException(status_code=409, detail="Export is not ready yet")
+    if not os.path.exists(job.path):
+        raise HTTPException(status_code=410, detail="Export result was superseded by newer data; create a new job")
+    return FileResponse(
+        job.path,
+        media_type=XLSX_MEDIA_TYPE,
+        headers={"Content-Disposition": f"attachment; filename*=utf-8''{quote(job.filename)}"}
+    )
+
+
+@app.get("/api/export/job-queue/stats")
+def get_export_job_stats(current_user: Principal = Depends(get_current_user)):
+    return export_jobs.stats()
+
+
+@app.get("/api/finance/payroll-cache/stats")
+def get_payroll_cache_stats(current_user: Principal = Depends(_require_finance_view)):
+    return payroll_cache.stats()
 
 
 @app.get("/api/finance/audit-log")
 def get_audit_log(db: Session = Depends(get_db),
-                  current_user: models.User = Depends(_require_finance_edit)):
-    logs = db.query(models.FinanceAuditLog).order_by(
+                  current_user: Principal = Depends(_require_finance_edit)):
+    logs = db.query(models.FinanceAuditLog).options(selectinload(models.FinanceAuditLog.user)).order_by(
         models.FinanceAuditLog.timestamp.desc()).limit(200).all()
     return [{
         "id": log.id,
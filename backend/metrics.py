@@ -0,0 +1,209 @@
+"""
+Per-request instrumentation, exposed in Prometheus text format on /metrics.
+
+MetricsMiddleware wraps the whole ASGI app, so latency and response size cover
+streamed bodies to the last byte. SQLAlchemy cursor events (on every engine,
+sync and async) add each statement's count, duration and driver-reported row
+count to the RequestStats of the request that issued it; the stats travel in a
+context variable, which follows the request into run_sync greenlets and the
+threadpool.
+
+Finance and export code marks its non-SQL work with phase("compute") and
+phase("render"); those requests also report a "query" phase (their DB time),
+so the three can be compared per route. Work outside a request, like the
+export job workers, is attributed with background("export_job:<kind>").
+
+In-process caches registered with register_cache() have their stats() read at
+scrape time and exported as timesheet_cache_* series labelled by cache.
+
+Like the other in-process counters, the metrics describe a single API process.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+REQUEST_SECONDS = Histogram(
+    "timesheet_http_request_duration_seconds", "Request latency, until the last body byte is sent",
+    ["method", "route"], buckets=LATENCY_BUCKETS)
+REQUESTS = Counter(
+    "timesheet_http_requests", "Requests by response status", ["method", "route", "status"])
+RESPONSE_BYTES = Histogram(
+    "timesheet_http_response_size_bytes", "Response body size",
+    ["method", "route"], buckets=(1e3, 1e4, 1e5, 1e6, 1e7, 1e8))
+DB_STATEMENTS = Histogram(
+    "timesheet_db_statements_per_request", "SQL statements executed per request",
+    ["route"], buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 500))
+DB_SECONDS = Histogram(
+    "timesheet_db_seconds_per_request", "Time spent executing SQL per request",
+    ["route"], buckets=LATENCY_BUCKETS)
+DB_ROWS = Histogram(
+    "timesheet_db_rows_per_request", "Rows per request as reported by the driver (cursor.rowcount)",
+    ["route"], buckets=(0, 10, 100, 1e3, 1e4, 1e5, 1e6))
+PHASE_SECONDS = Histogram(
+    "timesheet_request_phase_seconds", "Finance/export time split into query, compute and render",
+    ["route", "phase"], buckets=LATENCY_BUCKETS)
+
+# stats() keys of the caches -> exported series
+CACHE_COUNTERS = {
+    "hits": "Lookups served from the cache",
+    "misses": "Lookups that missed the cache",
+    "evictions": "Entries dropped to stay within the size bound",
+    "invalidations": "Explicit invalidations (data feeding the entries changed)",
+}
+CACHE_GAUGES = {
+    "size": ("timesheet_cache_entries", "Entries currently in the cache"),
+    "maxsize": ("timesheet_cache_max_entries", "Size bound of the cache"),
+}
+
+
+@dataclass
+class RequestStats:
+    label: str = ""
+    statements: int = 0
+    db_seconds: float = 0.0
+    rows: int = 0
+    phases: Dict[str, float] = field(default_factory=dict)
+    shapes: Dict[str, int] = field(default_factory=dict)   # filled by query_watch when enabled
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def current() -> Optional[RequestStats]:
+    """Stats of the request (or background task) running in this context, if any."""
+    return _current.get()
+
+
+# The start time lives on the execution context, which is dropped with the
+# statement: a failing statement never reaches after_cursor_execute, and state
+# on conn.info would outlive it for as long as the pooled connection
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    # Plans that query_watch fetches for slow queries are not the request's work
+    if stats is not None and not conn.info.get("query_watch_explaining"):
+        started = getattr(context, "_metrics_started", None)
+        stats.statements += 1
+        if started is not None:
+            stats.db_seconds += time.perf_counter() - started
+        stats.rows += max(cursor.rowcount or 0, 0)
+
+
+@contextmanager
+def phase(name: str):
+    """Times a block of the current request as `name`, excluding the SQL it runs."""
+    stats = _current.get()
+    if stats is None:
+        yield
+        return
+    started, db_before = time.perf_counter(), stats.db_seconds
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started - (stats.db_seconds - db_before)
+        stats.phases[name] = stats.phases.get(name, 0.0) + max(elapsed, 0.0)
+
+
+def _observe(route: str, stats: RequestStats):
+    DB_STATEMENTS.labels(route).observe(stats.statements)
+    DB_SECONDS.labels(route).observe(stats.db_seconds)
+    DB_ROWS.labels(route).observe(stats.rows)
+    if stats.phases:
+        PHASE_SECONDS.labels(route, "query").observe(stats.db_seconds)
+        for name, seconds in stats.phases.items():
+            PHASE_SECONDS.labels(route, name).observe(seconds)
+
+
+@contextmanager
+def background(label: str):
+    """Collects the statements and phases of work done outside a request under `label`."""
+    stats = RequestStats(label=label)
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+        _observe(label, stats)
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats(label=f"{scope['method']} {scope['path']}")
+        token = _current.set(stats)
+        status = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _current.reset(token)
+            # The route template, not the path, keeps the label set bounded
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            method = scope["method"]
+            REQUEST_SECONDS.labels(method, route).observe(elapsed)
+            REQUESTS.labels(method, route, str(status)).inc()
+            RESPONSE_BYTES.labels(method, route).observe(size)
+            _observe(route, stats)
+
+
+class _CacheCollector:
+    """Reads the registered caches' stats() on every scrape."""
+
+    def __init__(self):
+        self.caches: Dict[str, Callable[[], dict]] = {}
+
+    def collect(self):
+        families = {key: CounterMetricFamily(f"timesheet_cache_{key}", doc, labels=["cache"])
+                    for key, doc in CACHE_COUNTERS.items()}
+        families.update({key: GaugeMetricFamily(name, doc, labels=["cache"])
+                         for key, (name, doc) in CACHE_GAUGES.items()})
+        for cache, stats in self.caches.items():
+            for key, value in stats().items():
+                if key in families:
+                    families[key].add_metric([cache], value)
+        return list(families.values())
+
+
+_caches = _CacheCollector()
+REGISTRY.register(_caches)
+
+
+def register_cache(name: str, stats: Callable[[], dict]):
+    """Exports the counters of an LRUCache-style stats() dict under cache="name"."""
+    _caches.caches[name] = stats
+
+
+def render() -> bytes:
+    return generate_latest()
+
@@ -0,0 +1,196 @@
+"""
+Versioned schema migrations, applied in one process over one connection.
+
+    python migrate.py            # apply pending steps
+    python migrate.py --seed     # ... then seed the base data (seed.py)
+    python migrate.py --status   # print the current and latest version
+
+The schema_version table records every applied step. When the schema is
+current a run costs one SELECT; the API itself never changes the schema and
+only compares the version at startup.
+
+An empty database gets the current schema from models.py (create_all) and is
+stamped with the latest version without running the steps. An existing
+database without schema_version (from before this runner) gets its missing
+tables from create_all, then every step; they all check before they change
+anything, so rerunning one against a database that has it is harmless.
+
+New schema changes go in a migrate_<name>.py with an upgrade(conn), appended
+to STEPS below; models.py must describe the schema after the last step, as
+fresh databases never run them. Steps run in a transaction each, together
+with their version row, except those marked transactional=False (CREATE INDEX
+CONCURRENTLY), which get the connection in AUTOCOMMIT mode. On PostgreSQL an
+advisory lock keeps two containers from migrating at once.
+"""
+import argparse
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Optional
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, select, text
+from sqlalchemy.exc import DBAPIError
+
+import migrate_department_closure
+import migrate_employee_category
+import migrate_finance
+import migrate_month_totals
+import migrate_performance_indexes
+import migrate_phase11
+import migrate_positions
+import migrate_timesheet_unique
+import models
+from database import engine
+
+logger = logging.getLogger("timesheet.migrate")
+
+# Arbitrary key for pg_advisory_lock, shared by every migrate.py process
+ADVISORY_LOCK_KEY = 72_650_001
+
+schema_version = Table(
+    "schema_version", MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+def _role_permissions(conn):
+    # Formerly an inline migration in main.py, run on every API start
+    columns = {col["name"] for col in inspect(conn).get_columns("roles")}
+    for name in ("can_export", "can_manage_employees", "can_manage_users", "can_manage_departments"):
+        if name in columns:
+            print(f"  (skip) '{name}' column already exists in roles table")
+        else:
+            conn.execute(text(f"ALTER TABLE roles ADD COLUMN {name} BOOLEAN DEFAULT FALSE"))
+            print(f"✓ '{name}' column added to roles table")
+
+
+@dataclass(frozen=True)
+class Step:
+    version: int
+    name: str
+    upgrade: Callable
+    transactional: bool = True
+
+
+STEPS = [
+    Step(1, "positions", migrate_positions.upgrade),
+    Step(2, "finance", migrate_finance.upgrade),
+    Step(3, "employee_category", migrate_employee_category.upgrade),
+    Step(4, "phase11", migrate_phase11.upgrade),
+    Step(5, "role_permissions", _role_permissions),
+    Step(6, "timesheet_unique", migrate_timesheet_unique.upgrade),
+    Step(7, "month_totals", migrate_month_totals.upgrade),
+    Step(8, "department_closure", migrate_department_closure.upgrade),
+    Step(9, "performance_indexes", migrate_performance_indexes.upgrade, transactional=False),
+]
+LATEST = STEPS[-1].version
+
+
+def current_version(conn) -> Optional[int]:
+    """The applied version, 0 for an empty schema_version, None without the table."""
+    try:
+        with conn.begin():
+            return conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+    except DBAPIError:
+        return None
+
+
+def _record(conn, steps):
+    now = datetime.utcnow()
+    conn.execute(schema_version.insert(), [
+        {"version": step.version, "name": step.name, "applied_at": now} for step in steps
+    ])
+
+
+def _apply(conn, step: Step):
+    print(f"-- {step.version:03d} {step.name}")
+    if step.transactional:
+        with conn.begin():
+            step.upgrade(conn)
+            _record(conn, [step])
+        return
+    default = conn.default_isolation_level
+    conn.execution_options(isolation_level="AUTOCOMMIT")
+    try:
+        step.upgrade(conn)
+        conn.commit()
+    finally:
+        conn.execution_options(isolation_level=default)
+    with conn.begin():
+        _record(conn, [step])
+
+
+def migrate() -> int:
+    """Brings the database to LATEST; returns the number of steps applied."""
+    with engine.connect() as conn:
+        postgres = conn.dialect.name == "postgresql"
+        if postgres:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": ADVISORY_LOCK_KEY})
+            conn.commit()
+        try:
+            version = current_version(conn)
+            if version == LATEST:
+                print(f"✓ Schema is current (version {version})")
+                return 0
+
+            if version is None:
+                with conn.begin():
+                    fresh = not inspect(conn).has_table(models.Department.__tablename__)
+                    models.Base.metadata.create_all(bind=conn)
+                    schema_version.create(bind=conn, checkfirst=True)
+                    if fresh:
+                        _record(conn, STEPS)
+                if fresh:
+                    print(f"✓ Created the schema at version {LATEST}")
+                    return len(STEPS)
+                print("✓ Missing tables created; applying every step to the existing schema")
+                version = 0
+
+            pending = [step for step in STEPS if step.version > version]
+            for step in pending:
+                _apply(conn, step)
+            print(f"\n✓ Migrated to version {LATEST} ({len(pending)} steps)")
+            return len(pending)
+        finally:
+            if postgres:
+                conn.rollback()
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": ADVISORY_LOCK_KEY})
+                conn.commit()
+
+
+def check_version():
+    """Logs a warning when the database is behind this code; used at API startup."""
+    with engine.connect() as conn:
+        version = current_version(conn)
+    if version is None:
+        logger.warning("no schema_version table; run `python migrate.py` before starting the API")
+    elif version < LATEST:
+        logger.warning("database schema is at version %s, the code expects %s; run `python migrate.py`",
+                       version, LATEST)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--seed", action="store_true", help="seed the base data after migrating")
+    parser.add_argument("--status", action="store_true", help="print the versions and exit")
+    args = parser.parse_args()
+
+    if args.status:
+        with engine.connect() as conn:
+            version = current_version(conn)
+        print(f"database: {'no schema_version table' if version is None else version}, latest: {LATEST}")
+        for step in STEPS:
+            state = "applied" if version is not None and step.version <= version else "pending"
+            print(f"  {step.version:03d} {step.name:<22} {state}")
+        return
+
+    migrate()
+    if args.seed:
+        import seed
+        seed.seed_data()
+
+
+if __name__ == "__main__":
+    main()
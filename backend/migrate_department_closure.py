@@ -0,0 +1,41 @@
+"""
+Migration: department_closure table (ancestor, descendant, depth) for the
+department hierarchy. Creates the table if needed and (re)builds it from
+departments.parent_id with a recursive CTE whenever it is out of step, e.g.
+on the first run against an existing database.
+"""
+from sqlalchemy import func, inspect
+from sqlalchemy.orm import Session
+
+import department_closure
+import models
+
+def upgrade(conn):
+    if inspect(conn).has_table(models.DepartmentClosure.__tablename__):
+        print("  (skip) 'department_closure' table already exists")
+    else:
+        models.DepartmentClosure.__table__.create(bind=conn)
+        print("✓ 'department_closure' table created")
+
+    db = Session(bind=conn)
+    try:
+        departments = db.query(func.count(models.Department.id)).scalar()
+        linked = db.query(func.count()).select_from(models.DepartmentClosure).filter(
+            models.DepartmentClosure.depth == 0
+        ).scalar()
+        if departments == linked:
+            print(f"  (skip) closure already covers all {departments} departments")
+        else:
+            written = department_closure.rebuild(db)
+            db.flush()
+            print(f"✓ Built {written} closure rows for {departments} departments")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    from database import engine
+
+    print("Running department closure migration...")
+    with engine.begin() as conn:
+        upgrade(conn)
+    print("\n✓ Department closure migration complete!")
@@ -0,0 +1,39 @@
+"""
+Migration: employee_month_totals rollup (std, night and multiplier-weighted hours
+per employee and month). Creates the table if needed and backfills it from
+existing timesheets while it is empty, also when create_all made the table
+before the first run.
+"""
+from sqlalchemy import func, inspect
+from sqlalchemy.orm import Session
+
+import models
+import month_totals
+
+def upgrade(conn):
+    if inspect(conn).has_table(models.EmployeeMonthTotal.__tablename__):
+        print("  (skip) 'employee_month_totals' table already exists")
+    else:
+        models.EmployeeMonthTotal.__table__.create(bind=conn)
+        print("✓ 'employee_month_totals' table created")
+
+    db = Session(bind=conn)
+    try:
+        totals = db.query(func.count()).select_from(models.EmployeeMonthTotal).scalar()
+        marks = db.query(models.Timesheet.id).first() is not None
+        if totals or not marks:
+            print(f"  (skip) {totals} monthly totals present, nothing to backfill")
+        else:
+            written = month_totals.rebuild(db)
+            db.flush()
+            print(f"✓ Backfilled {written} monthly totals from timesheets")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    from database import engine
+
+    print("Running employee month totals migration...")
+    with engine.begin() as conn:
+        upgrade(conn)
+    print("\n✓ Employee month totals migration complete!")
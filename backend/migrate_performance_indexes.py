@@ -0,0 +1,112 @@
+"""
+Migration: indexes for the hot query shapes.
+
+    employees.dept_id            subtree filters of grids, exports and payroll
+    departments.parent_id        child lookups and the closure rebuild
+    users.employee_id            employee -> user lookups and FK checks on delete
+    salary_rates (dept, pos)     unique; duplicate rates are collapsed first,
+                                 keeping the newest row
+
+timesheets (employee_id, date) is already indexed by uq_timesheets_employee_date,
+which makes the single-column ix_timesheets_employee_id redundant; it is
+dropped to save a write per saved mark.
+
+On PostgreSQL the indexes are built and dropped CONCURRENTLY, so the API keeps
+writing during the migration; an invalid index left by an interrupted build is
+dropped and rebuilt on the next run. upgrade() therefore needs a connection in
+AUTOCOMMIT mode there.
+"""
+from sqlalchemy import inspect, text
+
+
+INDEXES = [
+    # (name, table, columns, unique)
+    ("ix_employees_dept_id", "employees", ["dept_id"], False),
+    ("ix_departments_parent_id", "departments", ["parent_id"], False),
+    ("ix_users_employee_id", "users", ["employee_id"], False),
+    ("uq_salary_rates_dept_position", "salary_rates", ["dept_id", "position_id"], True),
+]
+# (index, table, the index that covers it)
+REDUNDANT = [
+    ("ix_timesheets_employee_id", "timesheets", "uq_timesheets_employee_date"),
+]
+
+
+def existing_indexes(conn, table_name):
+    inspector = inspect(conn)
+    names = {ix["name"] for ix in inspector.get_indexes(table_name)}
+    names.update(uc["name"] for uc in inspector.get_unique_constraints(table_name))
+    return names
+
+def unique_columns(conn, table_name):
+    """Column tuples already covered by a unique constraint or index."""
+    inspector = inspect(conn)
+    covered = {tuple(uc["column_names"]) for uc in inspector.get_unique_constraints(table_name)}
+    covered.update(tuple(ix["column_names"]) for ix in inspector.get_indexes(table_name) if ix["unique"])
+    return covered
+
+def invalid_indexes(conn):
+    if conn.dialect.name != "postgresql":
+        return set()
+    return set(conn.execute(text("""
+        SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE NOT i.indisvalid
+    """)).scalars())
+
+def remove_duplicate_rates(conn):
+    result = conn.execute(text("""
+        DELETE FROM salary_rates
+        WHERE id NOT IN (SELECT MAX(id) FROM salary_rates GROUP BY dept_id, position_id)
+    """))
+    print(f"✓ Removed {result.rowcount} duplicate salary rates")
+
+def create_index(conn, name, table_name, columns, unique):
+    postgres = conn.dialect.name == "postgresql"
+    concurrently = " CONCURRENTLY" if postgres else ""
+    conn.execute(text(
+        f"CREATE {'UNIQUE ' if unique else ''}INDEX{concurrently} {name} ON {table_name} ({', '.join(columns)})"
+    ))
+    if unique and postgres:
+        # Promote to a named constraint, as declared in models.py
+        conn.execute(text(f"ALTER TABLE {table_name} ADD CONSTRAINT {name} UNIQUE USING INDEX {name}"))
+
+def drop_index(conn, name):
+    concurrently = " CONCURRENTLY" if conn.dialect.name == "postgresql" else ""
+    conn.execute(text(f"DROP INDEX{concurrently} IF EXISTS {name}"))
+
+def upgrade(conn):
+    invalid = invalid_indexes(conn)
+    for name, table_name, columns, unique in INDEXES:
+        if name in invalid:
+            drop_index(conn, name)
+            print(f"  dropped invalid '{name}' left by an interrupted build")
+        elif name in existing_indexes(conn, table_name):
+            print(f"  (skip) '{name}' already exists on {table_name} table")
+            continue
+        elif unique and tuple(columns) in unique_columns(conn, table_name):
+            # e.g. the unnamed UNIQUE (dept_id, position_id) of migrate_finance.py
+            print(f"  (skip) {table_name} ({', '.join(columns)}) is already unique")
+            continue
+        if table_name == "salary_rates":
+            remove_duplicate_rates(conn)
+        create_index(conn, name, table_name, columns, unique)
+        print(f"✓ '{name}' added to {table_name} table ({', '.join(columns)})")
+
+    for name, table_name, covering in REDUNDANT:
+        names = existing_indexes(conn, table_name)
+        if name not in names:
+            print(f"  (skip) '{name}' not present on {table_name} table")
+        elif covering not in names or covering in invalid:
+            print(f"  (skip) keeping '{name}': '{covering}' is missing, run migrate_timesheet_unique.py")
+        else:
+            drop_index(conn, name)
+            print(f"✓ '{name}' dropped, '{covering}' covers it")
+
+if __name__ == "__main__":
+    from database import engine
+
+    print("Running performance index migration...")
+    # CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        upgrade(conn)
+    print("\n✓ Performance index migration complete!")
@@ -2,25 +2,20 @@
 Migration: Add positions table and position_id FK to employees.
 Safe to run on a live PostgreSQL database — does NOT drop any existing table.
 """
-from database import engine
-from sqlalchemy import text
+from sqlalchemy import inspect, text
 
 def column_exists(conn, table_name, column_name):
-    query = text(f"""
-        SELECT column_name 
-        FROM information_schema.columns 
-        WHERE table_name='{table_name}' and column_name='{column_name}'
-    """)
-    return conn.execute(query).scalar() is not None
+    return column_name in {col["name"] for col in inspect(conn).get_columns(table_name)}
 
-with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+def upgrade(conn):
     # 1. Create the positions table if it doesn't exist (PostgreSQL syntax)
-    conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS positions (
-            id SERIAL PRIMARY KEY,
-            name VARCHAR NOT NULL UNIQUE
-        )
-    """))
+    if not inspect(conn).has_table("positions"):
+        conn.execute(text("""
+            CREATE TABLE positions (
+                id SERIAL PRIMARY KEY,
+                name VARCHAR NOT NULL UNIQUE
+            )
+        """))
     print("✓ positions table ready")
 
     # 2. Add position_id column to employees if it doesn't already exist
@@ -33,5 +28,10 @@ with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
     else:
         print("  position_id column already exists, skipping")
 
+if __name__ == "__main__":
+    from database import engine
+
+    with engine.begin() as conn:
+        upgrade(conn)
     print("\nMigration complete!")
     print("Tip: Open the 'Positions' admin tab to add positions, then edit employees to assign them.")
@@ -0,0 +1,43 @@
+"""
+Migration: unique (employee_id, date) constraint on timesheets.
+Required by the bulk upsert in POST /api/timesheet/update (ON CONFLICT target).
+Duplicate marks for the same employee and day are collapsed first, keeping the newest row.
+SQLite cannot add a constraint to an existing table, so it gets a unique index of the same name.
+"""
+from sqlalchemy import inspect, text
+
+CONSTRAINT_NAME = "uq_timesheets_employee_date"
+
+def constraint_exists(conn, table_name, constraint_name):
+    inspector = inspect(conn)
+    names = {uc["name"] for uc in inspector.get_unique_constraints(table_name)}
+    names.update(ix["name"] for ix in inspector.get_indexes(table_name) if ix["unique"])
+    return constraint_name in names
+
+def upgrade(conn):
+    if constraint_exists(conn, "timesheets", CONSTRAINT_NAME):
+        print(f"  (skip) '{CONSTRAINT_NAME}' already exists on timesheets table")
+        return
+
+    result = conn.execute(text("""
+        DELETE FROM timesheets
+        WHERE id NOT IN (SELECT MAX(id) FROM timesheets GROUP BY employee_id, date)
+    """))
+    print(f"✓ Removed {result.rowcount} duplicate timesheet rows")
+
+    if conn.dialect.name == "sqlite":
+        conn.execute(text(f"CREATE UNIQUE INDEX {CONSTRAINT_NAME} ON timesheets (employee_id, date)"))
+    else:
+        conn.execute(text(f"""
+            ALTER TABLE timesheets
+            ADD CONSTRAINT {CONSTRAINT_NAME} UNIQUE (employee_id, date)
+        """))
+    print(f"✓ '{CONSTRAINT_NAME}' added to timesheets table")
+
+if __name__ == "__main__":
+    from database import engine
+
+    print("Running timesheet unique constraint migration...")
+    with engine.begin() as conn:
+        upgrade(conn)
+    print("\n✓ Timesheet unique constraint migration complete!")
@@ -1,5 +1,6 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, Date, Boolean, select, func
-from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Date, Boolean, UniqueConstraint, select, func, and_
+from sqlalchemy.orm import declarative_base, object_session, relationship
+from datetime import timedelta
 
 Base = declarative_base()
 
@@ -8,7 +9,7 @@ class Department(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)
-    parent_id = Column(Integer, ForeignKey('departments.id'), nullable=True)
+    parent_id = Column(Integer, ForeignKey('departments.id'), nullable=True, index=True)
     category = Column(Integer, default=99)
     
     # Recursive tree structure for departments
@@ -17,6 +18,17 @@ class Department(Base):
 
     @property
     def full_name(self) -> str:
+        session = object_session(self)
+        if session is not None and self.id is not None:
+            # One query over the closure instead of one lazy load per level
+            names = session.execute(
+                select(Department.name)
+                .join(DepartmentClosure, DepartmentClosure.ancestor_id == Department.id)
+                .where(DepartmentClosure.descendant_id == self.id)
+                .order_by(DepartmentClosure.depth.desc())
+            ).scalars().all()
+            if names:
+                return " » ".join(names)
         names = []
         current = self
         while current:
@@ -24,6 +36,14 @@ class Department(Base):
             current = current.parent
         return " » ".join(reversed(names))
 
+class DepartmentClosure(Base):
+    """Every (ancestor, descendant) pair of the department tree, see department_closure.py."""
+    __tablename__ = 'department_closure'
+
+    ancestor_id = Column(Integer, ForeignKey('departments.id'), primary_key=True)
+    descendant_id = Column(Integer, ForeignKey('departments.id'), primary_key=True, index=True)
+    depth = Column(Integer, nullable=False)              # 0 for the department itself
+
 class WorkCode(Base):
     __tablename__ = 'work_codes'
     
@@ -52,7 +72,7 @@ class Employee(Base):
     full_name = Column(String, nullable=False)
     tab_number = Column(String, unique=True, index=True, nullable=False)
     category = Column(Integer, default=99)
-    dept_id = Column(Integer, ForeignKey('departments.id'), nullable=False)
+    dept_id = Column(Integer, ForeignKey('departments.id'), nullable=False, index=True)
     position_id = Column(Integer, ForeignKey('positions.id'), nullable=True)
     
     department = relationship("Department", back_populates="employees")
@@ -62,15 +82,30 @@ class Employee(Base):
 
 class Timesheet(Base):
     __tablename__ = 'timesheets'
+    __table_args__ = (
+        # One mark per employee per day; also the conflict target for bulk upserts and,
+        # as a composite index, the lookup for grid and save queries by employee
+        UniqueConstraint('employee_id', 'date', name='uq_timesheets_employee_date'),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    employee_id = Column(Integer, ForeignKey('employees.id'), nullable=False, index=True)
+    employee_id = Column(Integer, ForeignKey('employees.id'), nullable=False)
     date = Column(Date, nullable=False, index=True)
     work_code_id = Column(Integer, ForeignKey('work_codes.id'), nullable=False)
     
     employee = relationship("Employee", back_populates="timesheets")
     work_code = relationship("WorkCode", back_populates="timesheets")
 
+class EmployeeMonthTotal(Base):
+    """Per-employee monthly hour totals, maintained incrementally by timesheet saves."""
+    __tablename__ = 'employee_month_totals'
+
+    employee_id = Column(Integer, ForeignKey('employees.id'), primary_key=True)
+    month = Column(Date, primary_key=True)                 # first day of the month
+    std_hours = Column(Float, nullable=False, default=0.0)
+    night_hours = Column(Float, nullable=False, default=0.0)
+    weighted_hours = Column(Float, nullable=False, default=0.0)  # (std + night) * rate_multiplier
+
 class Role(Base):
     __tablename__ = 'roles'
     
@@ -97,7 +132,7 @@ class User(Base):
     hashed_password = Column(String)
     role_id = Column(Integer, ForeignKey('roles.id'), nullable=False)
     dept_id = Column(Integer, ForeignKey('departments.id'), nullable=True) # Used for managers to lock them to a dept
-    employee_id = Column(Integer, ForeignKey('employees.id'), nullable=True)
+    employee_id = Column(Integer, ForeignKey('employees.id'), nullable=True, index=True)
     
     role = relationship("Role", back_populates="users")
     department = relationship("Department")
@@ -111,6 +146,9 @@ class User(Base):
 class SalaryRate(Base):
     """Maps a department+position combination to an hourly rate."""
     __tablename__ = 'salary_rates'
+    __table_args__ = (
+        UniqueConstraint('dept_id', 'position_id', name='uq_salary_rates_dept_position'),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     dept_id = Column(Integer, ForeignKey('departments.id'), nullable=False)
@@ -137,22 +175,46 @@ class FinanceAuditLog(Base):
 
 
 # --- Service Logic for Calculating Timesheet Totals ---
+def _month_span(start_date, end_date):
+    """
+    Returns (first_month, last_month) as month-start dates when the range covers
+    whole calendar months, so totals can be read from employee_month_totals.
+    Returns None for partial months.
+    """
+    if start_date.day != 1 or end_date < start_date:
+        return None
+    if (end_date + timedelta(days=1)).day != 1:
+        return None
+    return start_date, end_date.replace(day=1)
+
 def calculate_employee_hours(session, employee_id: int, start_date, end_date):
     """
     Calculates the total standard and night hours for a given employee within a date range.
     This logic can be used by FastAPI endpoints or Report generation.
+    Whole-month ranges are read from the monthly rollup instead of raw timesheet rows.
     """
-    stmt = (
-        select(
-            func.sum(WorkCode.hours_standard).label("total_standard"),
-            func.sum(WorkCode.hours_night).label("total_night")
+    span = _month_span(start_date, end_date)
+    if span:
+        stmt = (
+            select(
+                func.sum(EmployeeMonthTotal.std_hours).label("total_standard"),
+                func.sum(EmployeeMonthTotal.night_hours).label("total_night")
+            )
+            .where(EmployeeMonthTotal.employee_id == employee_id)
+            .where(EmployeeMonthTotal.month.between(*span))
+        )
+    else:
+        stmt = (
+            select(
+                func.sum(WorkCode.hours_standard).label("total_standard"),
+                func.sum(WorkCode.hours_night).label("total_night")
+            )
+            .select_from(Timesheet)
+            .join(WorkCode, Timesheet.work_code_id == WorkCode.id)
+            .where(Timesheet.employee_id == employee_id)
+            .where(Timesheet.date >= start_date)
+            .where(Timesheet.date <= end_date)
         )
-        .select_from(Timesheet)
-        .join(WorkCode, Timesheet.work_code_id == WorkCode.id)
-        .where(Timesheet.employee_id == employee_id)
-        .where(Timesheet.date >= start_date)
-        .where(Timesheet.date <= end_date)
-    )
     result = session.execute(stmt).one_or_none()
     
     total_std = result.total_standard or 0.0 if result else 0.0
@@ -167,21 +229,36 @@ def calculate_employee_hours(session, employee_id: int, start_date, end_date):
 def calculate_department_hours(session, dept_id: int, start_date, end_date):
     """
     Calculates the aggregate totals for all employees in a specific department.
+    Whole-month ranges are read from the monthly rollup instead of raw timesheet rows.
     """
-    stmt = (
-        select(
-            Timesheet.employee_id,
-            func.sum(WorkCode.hours_standard).label("total_standard"),
-            func.sum(WorkCode.hours_night).label("total_night")
+    span = _month_span(start_date, end_date)
+    if span:
+        stmt = (
+            select(
+                EmployeeMonthTotal.employee_id,
+                func.sum(EmployeeMonthTotal.std_hours).label("total_standard"),
+                func.sum(EmployeeMonthTotal.night_hours).label("total_night")
+            )
+            .join(Employee, EmployeeMonthTotal.employee_id == Employee.id)
+            .where(Employee.dept_id == dept_id)
+            .where(EmployeeMonthTotal.month.between(*span))
+            .group_by(EmployeeMonthTotal.employee_id)
+        )
+    else:
+        stmt = (
+            select(
+                Timesheet.employee_id,
+                func.sum(WorkCode.hours_standard).label("total_standard"),
+                func.sum(WorkCode.hours_night).label("total_night")
+            )
+            .select_from(Timesheet)
+            .join(WorkCode, Timesheet.work_code_id == WorkCode.id)
+            .join(Employee, Timesheet.employee_id == Employee.id)
+            .where(Employee.dept_id == dept_id)
+            .where(Timesheet.date >= start_date)
+            .where(Timesheet.date <= end_date)
+            .group_by(Timesheet.employee_id)
         )
-        .select_from(Timesheet)
-        .join(WorkCode, Timesheet.work_code_id == WorkCode.id)
-        .join(Employee, Timesheet.employee_id == Employee.id)
-        .where(Employee.dept_id == dept_id)
-        .where(Timesheet.date >= start_date)
-        .where(Timesheet.date <= end_date)
-        .group_by(Timesheet.employee_id)
-    )
     results = session.execute(stmt).all()
     
     return [
@@ -193,3 +270,61 @@ def calculate_department_hours(session, dept_id: int, start_date, end_date):
         }
         for row in results
     ]
+
+def calculate_payroll_hours(session, start_date, end_date):
+    """
+    Aggregates standard, night and multiplier-weighted hours for every employee
+    within a date range using a single grouped query.
+    Employees without timesheet entries are returned with zero totals.
+    Whole-month ranges are read from the monthly rollup instead of raw timesheet rows.
+    """
+    return session.execute(payroll_hours_statement(start_date, end_date)).all()
+
+def payroll_hours_statement(start_date, end_date):
+    """The grouped SELECT behind calculate_payroll_hours, ordered by employee id."""
+    span = _month_span(start_date, end_date)
+    if span:
+        totals_join = (EmployeeMonthTotal, and_(
+            EmployeeMonthTotal.employee_id == Employee.id,
+            EmployeeMonthTotal.month.between(*span),
+        ))
+        total_std = EmployeeMonthTotal.std_hours
+        total_night = EmployeeMonthTotal.night_hours
+        weighted = EmployeeMonthTotal.weighted_hours
+    else:
+        hours_std = func.coalesce(WorkCode.hours_standard, 0.0)
+        hours_night = func.coalesce(WorkCode.hours_night, 0.0)
+        totals_join = (Timesheet, and_(
+            Timesheet.employee_id == Employee.id,
+            Timesheet.date >= start_date,
+            Timesheet.date <= end_date,
+        ))
+        total_std = hours_std
+        total_night = hours_night
+        weighted = (hours_std + hours_night) * work_code_multiplier()
+    stmt = (
+        select(
+            Employee.id.label("employee_id"),
+            Employee.full_name,
+            Employee.tab_number,
+            Employee.category,
+            Employee.dept_id,
+            Employee.position_id,
+            Department.name.label("dept_name"),
+            Position.name.label("position_name"),
+            func.coalesce(func.sum(total_std), 0.0).label("total_standard"),
+            func.coalesce(func.sum(total_night), 0.0).label("total_night"),
+            func.coalesce(func.sum(weighted), 0.0).label("weighted_hours"),
+        )
+        .select_from(Employee)
+        .outerjoin(Department, Employee.dept_id == Department.id)
+        .outerjoin(Position, Employee.position_id == Position.id)
+        .outerjoin(*totals_join)
+    )
+    if not span:
+        stmt = stmt.outerjoin(WorkCode, Timesheet.work_code_id == WorkCode.id)
+    return stmt.group_by(Employee.id, Department.name, Position.name).order_by(Employee.id)
+
+def work_code_multiplier():
+    """SQL expression for a work code's pay multiplier; missing or zero counts as 1.0."""
+    return func.coalesce(func.nullif(WorkCode.rate_multiplier, 0), 1.0)
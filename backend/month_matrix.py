@@ -0,0 +1,111 @@
+"""
+Vectorized month engine for hours and pay.
+
+A month is loaded as an (employees x days) int16 matrix of work-code indexes,
+with per-work-code vectors for standard hours, night hours and rate multiplier.
+Index 0 is "no mark" and contributes nothing. Totals per employee, department
+or day are then a fancy-index lookup plus a reduction, instead of nested Python
+loops reading WorkCode attributes cell by cell.
+"""
+import calendar
+from datetime import date
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+import models
+from department_closure import in_subtree
+
+
+class MonthMatrix:
+    def __init__(self, employee_ids, dept_ids, codes, work_code_ids, work_code_labels,
+                 hours_standard, hours_night, rate_multiplier):
+        self.employee_ids = employee_ids          # (E,) int64, sorted
+        self.dept_ids = dept_ids                  # (E,) int64
+        self.codes = codes                        # (E, D) int16, index into the vectors below
+        self.work_code_ids = work_code_ids        # (C,) int64, [0] is the empty mark
+        self.work_code_labels = work_code_labels  # (C,) object, [0] == ""
+        self.hours_standard = hours_standard      # (C,) float64
+        self.hours_night = hours_night            # (C,) float64
+        self.rate_multiplier = rate_multiplier    # (C,) float64
+
+    @property
+    def days(self) -> int:
+        return self.codes.shape[1]
+
+    def row_of(self, employee_id: int) -> int:
+        return int(np.searchsorted(self.employee_ids, employee_id))
+
+    def employee_totals(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Per-employee (std, night, weighted) hours; weighted applies the rate multiplier."""
+        std = self.hours_standard[self.codes].sum(axis=1)
+        night = self.hours_night[self.codes].sum(axis=1)
+        weighted = ((self.hours_standard + self.hours_night) * self.rate_multiplier)[self.codes].sum(axis=1)
+        return std, night, weighted
+
+    def day_totals(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Per-day (std, night) hours across all employees."""
+        return self.hours_standard[self.codes].sum(axis=0), self.hours_night[self.codes].sum(axis=0)
+
+    def department_totals(self) -> Dict[int, Tuple[float, float, float]]:
+        """dept_id -> (std, night, weighted) hours summed over its own employees."""
+        if not len(self.employee_ids):
+            return {}
+        depts, inverse = np.unique(self.dept_ids, return_inverse=True)
+        totals = [np.bincount(inverse, weights=column, minlength=len(depts)) for column in self.employee_totals()]
+        return {int(dept): (float(totals[0][i]), float(totals[1][i]), float(totals[2][i]))
+                for i, dept in enumerate(depts)}
+
+    def gross_pay(self, hourly_rates: np.ndarray) -> np.ndarray:
+        """Per-employee gross pay for an (E,) vector of hourly rates."""
+        return self.employee_totals()[2] * hourly_rates
+
+    def labels(self) -> np.ndarray:
+        """(E, D) array of work-code labels, "" where there is no mark."""
+        return self.work_code_labels[self.codes]
+
+
+def load_month_matrix(db, year: int, month: int, dept_id: Optional[int] = None) -> MonthMatrix:
+    """Loads one month for every employee, or for the employees of a department subtree."""
+    _, last_day = calendar.monthrange(year, month)
+    start_date = date(year, month, 1)
+    end_date = date(year, month, last_day)
+
+    employees = db.query(models.Employee.id, models.Employee.dept_id)
+    entries = db.query(
+        models.Timesheet.employee_id, models.Timesheet.date, models.Timesheet.work_code_id
+    ).filter(models.Timesheet.date >= start_date, models.Timesheet.date <= end_date)
+    if dept_id is not None:
+        employees = employees.filter(in_subtree(models.Employee.dept_id, dept_id))
+        entries = entries.join(models.Employee, models.Timesheet.employee_id == models.Employee.id).filter(
+            in_subtree(models.Employee.dept_id, dept_id)
+        )
+    emp_rows = employees.order_by(models.Employee.id).all()
+    employee_ids = np.array([row[0] for row in emp_rows], dtype=np.int64)
+    emp_dept_ids = np.array([row[1] for row in emp_rows], dtype=np.int64)
+
+    wc_rows = db.query(
+        models.WorkCode.id, models.WorkCode.code, models.WorkCode.hours_standard,
+        models.WorkCode.hours_night, models.WorkCode.rate_multiplier,
+    ).order_by(models.WorkCode.id).all()
+    work_code_ids = np.array([0] + [row[0] for row in wc_rows], dtype=np.int64)
+    labels = np.array([""] + [row[1] for row in wc_rows], dtype=object)
+    hours_standard = np.array([0.0] + [row[2] or 0.0 for row in wc_rows])
+    hours_night = np.array([0.0] + [row[3] or 0.0 for row in wc_rows])
+    rate_multiplier = np.array([1.0] + [row[4] or 1.0 for row in wc_rows])
+
+    codes = np.zeros((len(employee_ids), last_day), dtype=np.int16)
+    entry_rows = entries.all()
+    if entry_rows and len(employee_ids):
+        emp_col = np.fromiter((row[0] for row in entry_rows), dtype=np.int64, count=len(entry_rows))
+        day_col = np.fromiter((row[1].day - 1 for row in entry_rows), dtype=np.int64, count=len(entry_rows))
+        wc_col = np.fromiter((row[2] for row in entry_rows), dtype=np.int64, count=len(entry_rows))
+        # work_code_id -> vector index; unknown codes map to the empty mark
+        lookup = np.zeros(int(max(work_code_ids.max(), wc_col.max())) + 1, dtype=np.int16)
+        lookup[work_code_ids[1:]] = np.arange(1, len(work_code_ids), dtype=np.int16)
+        rows = np.searchsorted(employee_ids, emp_col)
+        known = (rows < len(employee_ids)) & (employee_ids[np.minimum(rows, len(employee_ids) - 1)] == emp_col)
+        codes[rows[known], day_col[known]] = lookup[wc_col[known]]
+
+    return MonthMatrix(employee_ids, emp_dept_ids, codes, work_code_ids, labels,
+                       hours_standard, hours_night, rate_multiplier)
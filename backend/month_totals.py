@@ -0,0 +1,147 @@
+"""
+Maintenance of the employee_month_totals rollup.
+
+apply_timesheet_changes() folds the effect of a timesheet save into the rollup
+inside the caller's transaction; rebuild() recomputes it from raw timesheet rows
+(used for backfills), rebuild_work_code() only the rows a work code contributes
+to (after its hours or multiplier change, or it is deleted).
+"""
+from datetime import date
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import Date, cast, delete, func, select
+
+import models
+from database import dialect_insert
+
+
+def _month_start(db, column):
+    if db.get_bind().dialect.name == "sqlite":
+        return func.date(column, "start of month")
+    return cast(func.date_trunc("month", column), Date)
+
+
+def _contributions(db) -> Dict[int, Tuple[float, float, float]]:
+    """work_code_id -> (std, night, weighted) hours added by one mark."""
+    result = {}
+    for wc_id, std, night, multiplier in db.query(
+        models.WorkCode.id, models.WorkCode.hours_standard,
+        models.WorkCode.hours_night, models.WorkCode.rate_multiplier,
+    ).all():
+        std = std or 0.0
+        night = night or 0.0
+        result[wc_id] = (std, night, (std + night) * (multiplier or 1.0))
+    return result
+
+
+def apply_timesheet_changes(db, changes: Iterable[Tuple[int, date, Optional[int], Optional[int]]]):
+    """
+    Applies (employee_id, date, old_work_code_id, new_work_code_id) changes to the
+    rollup with one upsert that adds the per-(employee, month) deltas.
+    The caller must hold row locks on the employees involved so the old codes
+    it read can't change before commit.
+    """
+    contributions = None
+    deltas: Dict[Tuple[int, date], list] = {}
+    for employee_id, day, old_wc, new_wc in changes:
+        if old_wc == new_wc:
+            continue
+        if contributions is None:
+            contributions = _contributions(db)
+        acc = deltas.setdefault((employee_id, day.replace(day=1)), [0.0, 0.0, 0.0])
+        for wc_id, sign in ((old_wc, -1.0), (new_wc, 1.0)):
+            if wc_id is None or wc_id not in contributions:
+                continue
+            for i, hours in enumerate(contributions[wc_id]):
+                acc[i] += sign * hours
+    if not deltas:
+        return
+
+    Total = models.EmployeeMonthTotal
+    stmt = dialect_insert(db)(Total)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Total.employee_id, Total.month],
+        set_={
+            "std_hours": Total.std_hours + stmt.excluded.std_hours,
+            "night_hours": Total.night_hours + stmt.excluded.night_hours,
+            "weighted_hours": Total.weighted_hours + stmt.excluded.weighted_hours,
+        }
+    )
+    db.execute(stmt, [
+        {"employee_id": employee_id, "month": month,
+         "std_hours": std, "night_hours": night, "weighted_hours": weighted}
+        for (employee_id, month), (std, night, weighted) in deltas.items()
+    ])
+
+
+def rebuild(db, start_month: Optional[date] = None, end_month: Optional[date] = None, employee_ids=None) -> int:
+    """
+    Recomputes the rollup from timesheets for months in [start_month, end_month]
+    (month-start dates, both optional) with one DELETE and one INSERT ... SELECT,
+    optionally only for `employee_ids` (a collection or a SELECT of ids).
+    Returns the number of rollup rows written. Does not commit.
+    """
+    Total = models.EmployeeMonthTotal
+    month = _month_start(db, models.Timesheet.date)
+    hours_std = func.coalesce(models.WorkCode.hours_standard, 0.0)
+    hours_night = func.coalesce(models.WorkCode.hours_night, 0.0)
+
+    cleanup = delete(Total)
+    source = (
+        select(
+            models.Timesheet.employee_id,
+            month.label("month"),
+            func.sum(hours_std),
+            func.sum(hours_night),
+            func.sum((hours_std + hours_night) * models.work_code_multiplier()),
+        )
+        .join(models.WorkCode, models.Timesheet.work_code_id == models.WorkCode.id)
+        .group_by(models.Timesheet.employee_id, month)
+    )
+    if start_month:
+        cleanup = cleanup.where(Total.month >= start_month)
+        source = source.where(models.Timesheet.date >= start_month)
+    if end_month:
+        cleanup = cleanup.where(Total.month <= end_month)
+        source = source.where(models.Timesheet.date < _next_month(end_month))
+    if employee_ids is not None:
+        cleanup = cleanup.where(Total.employee_id.in_(employee_ids))
+        source = source.where(models.Timesheet.employee_id.in_(employee_ids))
+
+    db.execute(cleanup)
+    result = db.execute(
+        dialect_insert(db)(Total).from_select(
+            ["employee_id", "month", "std_hours", "night_hours", "weighted_hours"], source
+        )
+    )
+    return result.rowcount
+
+
+def rebuild_work_code(db, wc_id: int) -> int:
+    """
+    Recomputes the rollup rows of every (employee, month) with a mark of work
+    code wc_id, one month at a time, leaving the rest of the rollup alone.
+    Returns the number of rollup rows written. Does not commit.
+    """
+    Timesheet = models.Timesheet
+    months = db.execute(
+        select(_month_start(db, Timesheet.date)).where(Timesheet.work_code_id == wc_id).distinct()
+    ).scalars().all()
+    written = 0
+    for month in sorted(_as_date(m) for m in months):
+        employees = select(Timesheet.employee_id).where(
+            Timesheet.work_code_id == wc_id,
+            Timesheet.date >= month,
+            Timesheet.date < _next_month(month),
+        )
+        written += rebuild(db, month, month, employee_ids=employees)
+    return written
+
+
+def _as_date(value) -> date:
+    # SQLite's date() returns the month start as an ISO string
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+
+def _next_month(month: date) -> date:
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
@@ -0,0 +1,58 @@
+"""
+LRU cache of payroll results keyed by "YYYY-MM".
+
+Entries are dropped only when data feeding that month changes: timesheet saves
+invalidate the months they touch, while salary rates, work code hours or
+multipliers, and employee/department/position edits invalidate every month.
+Each month also has a version; results computed before an invalidation are not
+stored, so a slow payroll run can't re-insert stale data.
+"""
+import os
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+from cache import LRUCache
+
+PAYROLL_CACHE_SIZE = int(os.getenv("PAYROLL_CACHE_SIZE", "24"))
+
+_cache = LRUCache(maxsize=PAYROLL_CACHE_SIZE)
+_lock = threading.Lock()
+_epoch = 0
+_month_versions: Dict[str, int] = {}
+invalidations = 0
+
+
+def month_version(year_month: str) -> Tuple[int, int]:
+    return _epoch, _month_versions.get(year_month, 0)
+
+
+def get(year_month: str) -> Optional[dict]:
+    return _cache.get(year_month)
+
+
+def put(year_month: str, result: dict, version: Tuple[int, int]):
+    """Stores result if nothing invalidated the month since `version` was taken."""
+    with _lock:
+        if version == month_version(year_month):
+            _cache.set(year_month, result)
+
+
+def invalidate_months(months: Iterable[str]):
+    global invalidations
+    with _lock:
+        for year_month in set(months):
+            _month_versions[year_month] = _month_versions.get(year_month, 0) + 1
+            _cache.pop(year_month)
+            invalidations += 1
+
+
+def invalidate_all():
+    global _epoch, invalidations
+    with _lock:
+        _epoch += 1
+        _cache.clear()
+        invalidations += 1
+
+
+def stats() -> dict:
+    return {**_cache.stats(), "invalidations": invalidations}
@@ -0,0 +1,105 @@
+"""
+Cached authentication principals.
+
+get_current_user resolves the JWT subject to a Principal: an immutable snapshot
+of the user id, role flags and active department. Principals are cached per
+(username, version) for PRINCIPAL_CACHE_TTL seconds; user, role and employee
+changes call invalidate_principals(), which bumps the version so entries loaded
+before the change are never served again.
+"""
+import os
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy.orm import joinedload
+
+import models
+from cache import LRUCache
+
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "4096"))
+
+
+@dataclass(frozen=True)
+class RoleFlags:
+    id: int
+    name: str
+    can_manage_settings: bool = False
+    can_edit_all: bool = False
+    can_view_all: bool = False
+    can_view_only: bool = True
+    can_view_finance: bool = False
+    can_edit_finance: bool = False
+    can_export: bool = False
+    can_manage_employees: bool = False
+    can_manage_users: bool = False
+    can_manage_departments: bool = False
+
+
+@dataclass(frozen=True)
+class Principal:
+    id: int
+    username: str
+    role: RoleFlags
+    dept_id: Optional[int]
+    employee_id: Optional[int]
+    active_dept_id: Optional[int]
+
+
+_cache = LRUCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
+_lock = threading.Lock()
+_version = 0
+
+
+def _load_principal(db, username: str) -> Optional[Principal]:
+    user = db.query(models.User).options(
+        joinedload(models.User.role), joinedload(models.User.employee)
+    ).filter(models.User.username == username).first()
+    if user is None or user.role is None:
+        return None
+    role = user.role
+    return Principal(
+        id=user.id,
+        username=user.username,
+        role=RoleFlags(
+            id=role.id,
+            name=role.name,
+            can_manage_settings=bool(role.can_manage_settings),
+            can_edit_all=bool(role.can_edit_all),
+            can_view_all=bool(role.can_view_all),
+            can_view_only=bool(role.can_view_only),
+            can_view_finance=bool(role.can_view_finance),
+            can_edit_finance=bool(role.can_edit_finance),
+            can_export=bool(role.can_export),
+            can_manage_employees=bool(role.can_manage_employees),
+            can_manage_users=bool(role.can_manage_users),
+            can_manage_departments=bool(role.can_manage_departments),
+        ),
+        dept_id=user.dept_id,
+        employee_id=user.employee_id,
+        active_dept_id=user.active_dept_id,
+    )
+
+
+def get_principal(db, username: str) -> Optional[Principal]:
+    key = (username, _version)
+    principal = _cache.get(key)
+    if principal is None:
+        principal = _load_principal(db, username)
+        if principal is not None:
+            _cache.set(key, principal)
+    return principal
+
+
+def invalidate_principals():
+    """Drops every cached principal; call after committing user, role or employee changes."""
+    global _version
+    with _lock:
+        _version += 1
+        _cache.clear()
+
+
+def principal_cache_stats() -> dict:
+    # Every invalidation bumps the version once
+    return {"invalidations": _version, **_cache.stats()}
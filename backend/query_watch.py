@@ -0,0 +1,120 @@
+"""
+SQL watchdog for development and staging: N+1 detection and a slow-query log.
+
+Off unless configured through the environment:
+
+    SQL_REPEAT_THRESHOLD  warn when one statement shape runs more than this many
+                          times within a request or export job (0 = off)
+    SQL_SLOW_MS           log statements slower than this many milliseconds,
+                          with their bound parameters (0 = off)
+    SQL_SLOW_EXPLAIN      also log the plan of slow SELECTs: EXPLAIN ANALYZE on
+                          PostgreSQL (the query runs a second time),
+                          EXPLAIN QUERY PLAN on SQLite
+
+A shape is the statement text with literals and expanded IN lists collapsed,
+so `WHERE id = 1` and `WHERE id IN (?, ?, ?)` repeat as the same shape whatever
+their values. Counts live on the request's metrics.RequestStats, so work in
+run_sync greenlets and the threadpool counts towards the request that caused
+it. The N+1 warning fires once per shape and request, with the application
+frames that issued the statement. The EXPLAIN it runs for a slow query is not
+counted in the request's metrics.
+"""
+import logging
+import os
+import re
+import time
+import traceback
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import metrics
+
+SQL_REPEAT_THRESHOLD = int(os.getenv("SQL_REPEAT_THRESHOLD", "0"))
+SQL_SLOW_MS = float(os.getenv("SQL_SLOW_MS", "0"))
+SQL_SLOW_EXPLAIN = os.getenv("SQL_SLOW_EXPLAIN", "false").strip().lower() in ("1", "true", "yes", "on")
+
+STACK_FRAMES = 6
+MAX_PARAMS_CHARS = 2000
+
+logger = logging.getLogger("timesheet.sql")
+
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+_SKIP_FILES = {os.path.abspath(__file__), os.path.join(_APP_DIR, "metrics.py")}
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w$])\d+(?:\.\d+)?\b")
+_PLACEHOLDERS = re.compile(r"\(\s*(?:\?|%s|%\(\w+\)s|\$\d+|:\w+)(?:\s*,\s*(?:\?|%s|%\(\w+\)s|\$\d+|:\w+))*\s*\)")
+_SPACE = re.compile(r"\s+")
+_WRITES = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE)\b", re.IGNORECASE)
+
+
+def fingerprint(statement: str) -> str:
+    shape = _STRING.sub("?", statement)
+    shape = _NUMBER.sub("?", shape)
+    shape = _PLACEHOLDERS.sub("(?)", shape)
+    return _SPACE.sub(" ", shape).strip()
+
+
+def _app_stack() -> str:
+    frames = [f for f in traceback.extract_stack()[:-2]
+              if f.filename.startswith(_APP_DIR) and f.filename not in _SKIP_FILES]
+    return "".join(traceback.format_list(frames[-STACK_FRAMES:])).rstrip()
+
+
+def _is_read_only(statement: str) -> bool:
+    # EXPLAIN ANALYZE executes the statement, so anything that writes is left alone
+    words = statement.split(None, 1)
+    head = words[0].upper() if words else ""
+    return head == "SELECT" or (head == "WITH" and not _WRITES.search(statement))
+
+
+def _explain(conn, statement, parameters) -> str:
+    # The flag keeps the plan query out of this watchdog and out of the request's metrics
+    prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN ANALYZE "
+    conn.info["query_watch_explaining"] = True
+    try:
+        rows = conn.exec_driver_sql(prefix + statement, parameters).fetchall()
+    except Exception as exc:
+        return f"(plan unavailable: {exc.__class__.__name__}: {exc})"
+    finally:
+        conn.info["query_watch_explaining"] = False
+    return "\n".join(" | ".join(str(col) for col in row) for row in rows)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # On the execution context, like metrics: failed statements never reach the after hook
+    if context is not None:
+        context._query_watch_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_query_watch_started", None)
+    if started is None or conn.info.get("query_watch_explaining"):
+        return
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    stats = metrics.current()
+    if SQL_REPEAT_THRESHOLD and stats is not None:
+        shape = fingerprint(statement)
+        count = stats.shapes.get(shape, 0) + 1
+        stats.shapes[shape] = count
+        if count == SQL_REPEAT_THRESHOLD + 1:
+            logger.warning("possible N+1 in %s: statement shape ran %d times\n  %s\n%s",
+                           stats.label or "?", count, shape, _app_stack())
+
+    if SQL_SLOW_MS and elapsed_ms >= SQL_SLOW_MS:
+        params = repr(parameters)
+        if len(params) > MAX_PARAMS_CHARS:
+            params = params[:MAX_PARAMS_CHARS] + "..."
+        message = [f"slow query ({elapsed_ms:.1f} ms) in {stats.label if stats else 'no request'}:",
+                   statement, f"params: {params}"]
+        streaming = context is not None and context.execution_options.get("stream_results")
+        if SQL_SLOW_EXPLAIN and not executemany and not streaming and _is_read_only(statement):
+            message.append("plan:\n" + _explain(conn, statement, parameters))
+        logger.warning("\n".join(message))
+
+
+if SQL_REPEAT_THRESHOLD or SQL_SLOW_MS:
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
@@ -0,0 +1,37 @@
+"""
+Rebuilds the employee_month_totals rollup from raw timesheet rows.
+
+Usage:
+    python rebuild_month_totals.py                     # every month
+    python rebuild_month_totals.py 2025-01 2025-12     # an inclusive month range
+"""
+import sys
+from datetime import date
+
+from database import SessionLocal
+import month_totals
+
+
+def _parse_month(value: str) -> date:
+    year, month = map(int, value.split("-"))
+    return date(year, month, 1)
+
+
+def main(argv):
+    start_month = _parse_month(argv[0]) if len(argv) > 0 else None
+    end_month = _parse_month(argv[1]) if len(argv) > 1 else start_month
+    db = SessionLocal()
+    try:
+        written = month_totals.rebuild(db, start_month, end_month)
+        db.commit()
+        scope = f"{argv[0]}..{argv[1] if len(argv) > 1 else argv[0]}" if argv else "all months"
+        print(f"✓ Rebuilt employee_month_totals for {scope}: {written} rows")
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,8 +1,9 @@
 import os
 import sys
 from sqlalchemy.orm import Session
-from database import SessionLocal, engine
+from database import SessionLocal
 import models
+import department_closure
 from passlib.context import CryptContext
 
 def seed_data():
@@ -56,6 +57,7 @@ def seed_data():
         transport = models.Department(name="Transport Service", parent_id=ops.id)
         db.add(transport)
         db.flush()
+        department_closure.rebuild(db)
 
         # 3. Create Employees
         managers = [
@@ -96,6 +98,17 @@ def seed_data():
         db.close()
 
 if __name__ == "__main__":
-    # Ensure tables exist
-    models.Base.metadata.create_all(bind=engine)
+    import argparse
+    import migrate
+    import seed_scale
+
+    parser = argparse.ArgumentParser(description="Seeds the base data; --scale adds a large synthetic organisation.")
+    parser.add_argument("--scale", action="store_true", help="also generate a synthetic organisation (see seed_scale.py)")
+    seed_scale.add_arguments(parser)
+    args = parser.parse_args()
+
+    # Ensure the schema is current
+    migrate.migrate()
     seed_data()
+    if args.scale:
+        seed_scale.generate(args)
@@ -0,0 +1,243 @@
+"""
+Synthetic large-organisation generator for performance work.
+
+    python seed.py --scale --employees 50000 --months 24 --depth 3 --fanout 6
+
+Builds a "Synthetic Org" department tree (`--fanout` children per level,
+`--depth` levels below the root; the first level are services, category 1),
+positions, salary rates for every leaf department and position, employees
+spread over the leaf departments and `--months` of timesheet marks ending with
+the current month. `--fill` is the share of days marked, `--mix` the work-code
+weights (e.g. "8=50,Д=20,Н=15,О=10,К=5"). `--users` adds timesheet editors
+(password `--password`) locked to random services, for load tests.
+
+Rows are generated month by month with numpy and bulk-loaded with COPY on
+PostgreSQL, or with batched executemany inserts on other databases. Everything
+lands in one transaction together with the department_closure and
+employee_month_totals rebuilds. Runs once per database: a second run stops if
+the synthetic root already exists.
+"""
+import argparse
+import calendar
+import itertools
+import time
+from datetime import date
+
+import numpy as np
+from passlib.context import CryptContext
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import Session
+
+import department_closure
+import models
+import month_totals
+from database import engine
+
+ROOT_NAME = "Synthetic Org"
+INSERT_BATCH = 50_000
+DEFAULT_MIX = "8=50,Д=20,Н=15,О=10,К=5"
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    group = parser.add_argument_group("--scale options")
+    group.add_argument("--employees", type=int, default=5000)
+    group.add_argument("--months", type=int, default=12, help="months of history, ending with the current month")
+    group.add_argument("--depth", type=int, default=3, help="department levels below the root")
+    group.add_argument("--fanout", type=int, default=5, help="child departments per department")
+    group.add_argument("--positions", type=int, default=20)
+    group.add_argument("--fill", type=float, default=0.85, help="share of employee-days with a mark")
+    group.add_argument("--mix", default=DEFAULT_MIX, help="work-code weights, CODE=WEIGHT,...")
+    group.add_argument("--users", type=int, default=0, help="timesheet editor accounts to create")
+    group.add_argument("--password", default="loadtest", help="password of the generated users")
+    group.add_argument("--seed", type=int, default=2024)
+
+
+def _months_back(count: int):
+    today = date.today()
+    index = today.year * 12 + today.month - 1 - (count - 1)
+    return [divmod(i, 12) for i in range(index, index + count)]   # (year, month - 1)
+
+
+def _copy_field(value) -> str:
+    if value is None:
+        return r"\N"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+
+class _CopySource:
+    """File-like view of row tuples as COPY text, read lazily by the driver."""
+
+    def __init__(self, rows):
+        self._lines = ("\t".join(map(_copy_field, row)) + "\n" for row in rows)
+        self._buffer = ""
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self._buffer) < size:
+            chunk = "".join(itertools.islice(self._lines, 10_000))
+            if not chunk:
+                break
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        out, self._buffer = self._buffer[:size], self._buffer[size:]
+        return out
+
+
+def bulk_load(conn, table, columns, rows) -> int:
+    """Loads row tuples into `table` with COPY (PostgreSQL) or batched inserts. Returns the row count."""
+    count = 0
+
+    def counted():
+        nonlocal count
+        for row in rows:
+            count += 1
+            yield row
+
+    if conn.dialect.name == "postgresql":
+        sql = f"COPY {table.name} ({', '.join(columns)}) FROM STDIN"
+        source = _CopySource(counted())
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            if hasattr(cursor, "copy_expert"):      # psycopg2
+                cursor.copy_expert(sql, source)
+            else:                                   # psycopg 3
+                with cursor.copy(sql) as copy:
+                    for chunk in iter(lambda: source.read(1 << 16), ""):
+                        copy.write(chunk)
+        finally:
+            cursor.close()
+    else:
+        statement = table.insert()
+        source = counted()
+        while True:
+            batch = [dict(zip(columns, row)) for row in itertools.islice(source, INSERT_BATCH)]
+            if not batch:
+                break
+            conn.execute(statement, batch)
+    return count
+
+
+def _next_ids(conn, table, count: int) -> range:
+    start = (conn.execute(select(func.max(table.c.id))).scalar() or 0) + 1
+    return range(start, start + count)
+
+
+def _reset_sequence(conn, table):
+    # Rows were loaded with explicit ids; move the serial past them
+    if conn.dialect.name == "postgresql":
+        conn.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), (SELECT MAX(id) FROM {table.name}))"
+        ))
+
+
+def _parse_mix(conn, mix: str):
+    codes = dict(conn.execute(select(models.WorkCode.code, models.WorkCode.id)).all())
+    ids, weights = [], []
+    for part in mix.split(","):
+        code, _, weight = part.partition("=")
+        if code.strip() not in codes:
+            raise SystemExit(f"Unknown work code {code.strip()!r} in --mix (have: {', '.join(codes)})")
+        ids.append(codes[code.strip()])
+        weights.append(float(weight or 1))
+    weights = np.array(weights) / sum(weights)
+    return np.array(ids, dtype=np.int64), weights
+
+
+def _departments(conn, depth: int, fanout: int):
+    """Returns (rows, leaf ids, service ids) for the synthetic tree."""
+    table = models.Department.__table__
+    total = 1 + sum(fanout ** level for level in range(1, depth + 1))
+    ids = iter(_next_ids(conn, table, total))
+    root = next(ids)
+    rows = [(root, ROOT_NAME, None, 99)]
+    level_nodes = [(root, "")]
+    services = []
+    for level in range(1, depth + 1):
+        next_level = []
+        for parent_id, label in level_nodes:
+            for n in range(1, fanout + 1):
+                dept_id = next(ids)
+                child_label = f"{label}.{n}" if label else str(n)
+                kind = "Service" if level == 1 else "Unit"
+                rows.append((dept_id, f"{kind} {child_label}", parent_id, 1 if level == 1 else 99))
+                next_level.append((dept_id, child_label))
+                if level == 1:
+                    services.append(dept_id)
+        level_nodes = next_level
+    return rows, [dept_id for dept_id, _ in level_nodes], services
+
+
+def _timesheet_rows(employee_ids, code_ids, weights, fill, months, rng):
+    for year, month0 in months:
+        days = calendar.monthrange(year, month0 + 1)[1]
+        day_dates = [date(year, month0 + 1, d) for d in range(1, days + 1)]
+        codes = rng.choice(code_ids, size=(len(employee_ids), days), p=weights)
+        emp_index, day_index = np.nonzero(rng.random((len(employee_ids), days)) < fill)
+        yield from zip(employee_ids[emp_index].tolist(),
+                       [day_dates[d] for d in day_index.tolist()],
+                       codes[emp_index, day_index].tolist())
+
+
+def generate(args):
+    rng = np.random.default_rng(args.seed)
+    months = _months_back(args.months)
+    started = time.perf_counter()
+
+    def step(message):
+        print(f"✓ {message} ({time.perf_counter() - started:.1f} s)")
+
+    with engine.begin() as conn:
+        if conn.execute(select(models.Department.id).where(models.Department.name == ROOT_NAME)).first():
+            raise SystemExit(f"'{ROOT_NAME}' already exists; run --scale against a fresh database")
+        if conn.dialect.name == "postgresql":
+            conn.execute(text("SET LOCAL synchronous_commit = off"))
+        code_ids, weights = _parse_mix(conn, args.mix)
+
+        dept_rows, leaves, services = _departments(conn, args.depth, args.fanout)
+        bulk_load(conn, models.Department.__table__, ["id", "name", "parent_id", "category"], dept_rows)
+
+        position_ids = list(_next_ids(conn, models.Position.__table__, args.positions))
+        bulk_load(conn, models.Position.__table__, ["id", "name"],
+                  [(pid, f"Synthetic position {n:03d}") for n, pid in enumerate(position_ids, 1)])
+        rates = rng.uniform(5.0, 40.0, size=len(leaves) * len(position_ids)).round(2).tolist()
+        bulk_load(conn, models.SalaryRate.__table__, ["dept_id", "position_id", "hourly_rate"],
+                  ((d, p, r) for (d, p), r in zip(itertools.product(leaves, position_ids), rates)))
+        step(f"{len(dept_rows)} departments, {len(position_ids)} positions, {len(rates)} salary rates")
+
+        employee_ids = np.array(_next_ids(conn, models.Employee.__table__, args.employees), dtype=np.int64)
+        emp_depts = rng.choice(leaves, size=args.employees).tolist()
+        emp_positions = rng.choice(position_ids, size=args.employees).tolist()
+        emp_categories = rng.integers(1, 5, size=args.employees).tolist()
+        bulk_load(conn, models.Employee.__table__,
+                  ["id", "full_name", "tab_number", "category", "dept_id", "position_id"],
+                  ((eid, f"Synthetic Employee {eid}", f"SYN-{eid:07d}", cat, dept, pos)
+                   for eid, dept, pos, cat in zip(employee_ids.tolist(), emp_depts, emp_positions, emp_categories)))
+        step(f"{args.employees} employees")
+
+        if args.users:
+            role_id = conn.execute(models.Role.__table__.insert().values(
+                name="Synthetic editor", can_view_only=False, can_export=True,
+            )).inserted_primary_key[0]
+            hashed = CryptContext(schemes=["bcrypt"], deprecated="auto").hash(args.password)
+            bulk_load(conn, models.User.__table__, ["username", "hashed_password", "role_id", "dept_id"],
+                      ((f"syn-user-{n:04d}", hashed, role_id, services[n % len(services)])
+                       for n in range(1, args.users + 1)))
+            step(f"{args.users} users (syn-user-0001.., password '{args.password}')")
+
+        marks = bulk_load(conn, models.Timesheet.__table__, ["employee_id", "date", "work_code_id"],
+                          _timesheet_rows(employee_ids, code_ids, weights, args.fill, months, rng))
+        step(f"{marks:,} timesheet marks over {args.months} months")
+
+        for table in (models.Department.__table__, models.Position.__table__, models.Employee.__table__):
+            _reset_sequence(conn, table)
+        db = Session(bind=conn)
+        department_closure.rebuild(db)
+        first, last = months[0], months[-1]
+        month_totals.rebuild(db, date(first[0], first[1] + 1, 1), date(last[0], last[1] + 1, 1))
+        db.close()
+        step("department_closure and employee_month_totals rebuilt")
+
+    if engine.dialect.name == "postgresql":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("ANALYZE"))
+        step("ANALYZE")
@@ -0,0 +1,316 @@
+"""
+T-13 timesheet export built on openpyxl's write-only (streaming) workbook.
+
+Rows are produced by a generator and styled with shared named styles, so the
+workbook never holds the sheet in memory. build_t13_workbook() spools the sheet
+to a temporary file that save() then copies into the archive, so nothing is
+written before the last row. write_t13_workbook() instead opens the sheet's zip
+entry first and writes each row into it as it is generated; stream_workbook()
+runs it on a background thread and yields the .xlsx bytes as they come, so the
+client gets the first bytes after about one chunk of compressed rows.
+
+That relies on openpyxl internals (the worksheet writer and ExcelWriter), so it
+is tied to the openpyxl version pinned in requirements.txt and checked by
+benchmarks/check_t13_stream.py; any other version falls back to save().
+"""
+import calendar
+import contextvars
+import datetime
+import queue
+import threading
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+from zipfile import ZIP_DEFLATED, ZipFile
+
+import openpyxl
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.drawing.spreadsheet_drawing import SpreadsheetDrawing
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet._writer import WorksheetWriter
+from openpyxl.worksheet.cell_range import CellRange
+from openpyxl.writer.excel import ExcelWriter
+
+import models
+import metrics
+from department_closure import in_subtree
+from month_matrix import load_month_matrix
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# The openpyxl release write_t13_workbook() was checked against (requirements.txt)
+STREAMING_OPENPYXL = "3.1.5"
+
+HEADER_STYLE = "t13_header"
+BANNER_STYLE = "t13_banner"
+CELL_STYLE = "t13_cell"
+CENTER_STYLE = "t13_cell_center"
+
+
+class T13Employee(NamedTuple):
+    id: int
+    full_name: str
+    tab_number: str
+    category: Optional[int]
+    dept_id: int
+    position_name: Optional[str]
+
+
+class T13Data(NamedTuple):
+    """Everything needed to render one T-13 sheet, detached from the ORM session."""
+    year_month: str
+    last_day: int
+    departments: list                        # DepartmentNode rows in the exported subtree
+    employees: List[T13Employee]
+    codes: Dict[int, List[str]]               # employee_id -> work code per day ("" = none)
+    totals: Dict[int, Tuple[float, float, float]]  # employee_id -> (std, night, total)
+
+
+def load_t13_data(db, tree, dept_id: int, year: int, month: int) -> T13Data:
+    """Loads the employees, marks and totals of a department subtree for one month."""
+    return load_t13_slices(db, tree, [dept_id], year, month)[0]
+
+
+def load_t13_slices(db, tree, dept_ids: List[int], year: int, month: int) -> List[T13Data]:
+    """Loads the month once and cuts it into one T13Data per department subtree.
+
+    A single department is loaded through its closure subtree; several are
+    loaded org-wide in one pass and sliced in memory.
+    """
+    scope = dept_ids[0] if len(dept_ids) == 1 else None
+    _, last_day = calendar.monthrange(year, month)
+
+    employees = db.query(
+        models.Employee.id,
+        models.Employee.full_name,
+        models.Employee.tab_number,
+        models.Employee.category,
+        models.Employee.dept_id,
+        models.Position.name,
+    ).outerjoin(models.Position, models.Employee.position_id == models.Position.id)
+    if scope is not None:
+        employees = employees.filter(in_subtree(models.Employee.dept_id, scope))
+    employees = [T13Employee(*row) for row in employees.all()]
+
+    # Marks and totals both come from the month matrix: one vectorized pass over the cells
+    matrix = load_month_matrix(db, year, month, scope)
+    labels = matrix.labels()
+    std, night, _ = matrix.employee_totals()
+    codes = {}
+    totals = {}
+    for row, emp_id in enumerate(matrix.employee_ids.tolist()):
+        codes[emp_id] = labels[row].tolist()
+        totals[emp_id] = (round(float(std[row]), 1), round(float(night[row]), 1),
+                          round(float(std[row] + night[row]), 1))
+
+    slices = []
+    for dept_id in dept_ids:
+        subtree = tree.descendants(dept_id)
+        members = set(subtree)
+        dept_emps = [emp for emp in employees if emp.dept_id in members]
+        slices.append(T13Data(
+            year_month=f"{year:04d}-{month:02d}",
+            last_day=last_day,
+            departments=[tree.nodes[did] for did in subtree if did in tree.nodes],
+            employees=dept_emps,
+            codes={emp.id: codes[emp.id] for emp in dept_emps if emp.id in codes},
+            totals={emp.id: totals[emp.id] for emp in dept_emps if emp.id in totals},
+        ))
+    return slices
+
+
+def _register_styles(wb: Workbook):
+    thin = Side(style="thin")
+    border = Border(left=thin, right=thin, top=thin, bottom=thin)
+    wb.add_named_style(NamedStyle(
+        name=HEADER_STYLE,
+        font=Font(bold=True, color="1E293B"),
+        fill=PatternFill(fill_type="solid", fgColor="F8FAFC"),
+        alignment=Alignment(horizontal="center", vertical="center"),
+        border=border,
+    ))
+    wb.add_named_style(NamedStyle(
+        name=BANNER_STYLE,
+        font=Font(bold=True, color="0F172A"),
+        fill=PatternFill(fill_type="solid", fgColor="E2E8F0"),
+        border=border,
+    ))
+    wb.add_named_style(NamedStyle(name=CELL_STYLE, border=border))
+    wb.add_named_style(NamedStyle(name=CENTER_STYLE, border=border, alignment=Alignment(horizontal="center")))
+
+
+def _styled(ws, value, style):
+    cell = WriteOnlyCell(ws, value=value)
+    cell.style = style
+    return cell
+
+
+def _t13_rows(ws, data: T13Data):
+    """Yields the sheet rows: header, then a banner and employee rows per department."""
+    width = 4 + data.last_day + 3
+    headers = ["Employee Name", "Tab No.", "Position", "Category"]
+    headers.extend(str(day) for day in range(1, data.last_day + 1))
+    headers.extend(["Std Hrs", "Night Hrs", "Total Hrs"])
+    yield [_styled(ws, h, HEADER_STYLE) for h in headers]
+
+    depts_map = {d.id: d for d in data.departments}
+    by_dept: Dict[int, List[T13Employee]] = {}
+    for emp in data.employees:
+        by_dept.setdefault(emp.dept_id, []).append(emp)
+
+    # Departments top-down by category, then by ID
+    row_idx = 2
+    for dept in sorted(data.departments, key=lambda d: (d.category or 99, d.id)):
+        dept_emps = by_dept.get(dept.id)
+        if not dept_emps:
+            continue
+
+        parent_name = ""
+        if dept.parent_id and dept.parent_id in depts_map:
+            parent_name = f"{depts_map[dept.parent_id].name} » "
+        # Banner is merged across all columns; the covered cells keep the border
+        ws.merged_cells.add(CellRange(min_col=1, min_row=row_idx, max_col=width, max_row=row_idx))
+        yield [_styled(ws, f"{parent_name}{dept.name}", BANNER_STYLE)] + \
+              [_styled(ws, None, CELL_STYLE) for _ in range(width - 1)]
+        row_idx += 1
+
+        dept_emps.sort(key=lambda e: (e.category or 99, e.full_name))
+        for emp in dept_emps:
+            # Employees added between the two loads have no marks yet
+            marks = data.codes.get(emp.id) or [""] * data.last_day
+            cat_name = str(emp.category) if emp.category is not None else "99"
+            row = [
+                _styled(ws, emp.full_name, CELL_STYLE),
+                _styled(ws, emp.tab_number, CELL_STYLE),
+                _styled(ws, emp.position_name or "—", CELL_STYLE),
+                _styled(ws, cat_name, CELL_STYLE),
+            ]
+            row.extend(_styled(ws, mark, CENTER_STYLE) for mark in marks)
+            row.extend(_styled(ws, value, CENTER_STYLE) for value in data.totals.get(emp.id, (0.0, 0.0, 0.0)))
+            yield row
+            row_idx += 1
+
+
+def _new_t13_workbook(data: T13Data):
+    wb = Workbook(write_only=True)
+    _register_styles(wb)
+    ws = wb.create_sheet(f"Timesheet {data.year_month}")
+
+    # Column widths must be set before the first row is written
+    ws.column_dimensions['A'].width = 30
+    ws.column_dimensions['B'].width = 12
+    ws.column_dimensions['C'].width = 20
+    ws.column_dimensions['D'].width = 10
+    for day in range(1, data.last_day + 1):
+        ws.column_dimensions[get_column_letter(day + 4)].width = 5
+    for c in range(1, 4):
+        ws.column_dimensions[get_column_letter(data.last_day + 4 + c)].width = 10
+    return wb, ws
+
+
+def build_t13_workbook(data: T13Data) -> Workbook:
+    wb, ws = _new_t13_workbook(data)
+    for row in _t13_rows(ws, data):
+        ws.append(row)
+    return wb
+
+
+class _StreamedSheetWriter(ExcelWriter):
+    """ExcelWriter for a workbook whose sheet XML is already in the archive."""
+
+    def write_worksheet(self, ws):
+        ws._drawing = SpreadsheetDrawing()
+        ws._rels = ws._writer._rels
+        self.manifest.append(ws)
+
+
+def write_t13_workbook(data: T13Data, fileobj):
+    """Writes the T-13 .xlsx to fileobj, which may be write-only and non-seekable.
+
+    The sheet is the first part of the archive: its zip entry is opened before
+    the first row and every appended row goes straight into it. The styles,
+    workbook and manifest parts follow once the sheet is closed.
+    """
+    if openpyxl.__version__ != STREAMING_OPENPYXL:
+        build_t13_workbook(data).save(fileobj)
+        return
+    wb, ws = _new_t13_workbook(data)
+    wb.properties.modified = datetime.datetime.now(tz=datetime.timezone.utc).replace(tzinfo=None)
+    # ExcelWriter numbers the sheets from 1; the entry name must match
+    ws._id = 1
+    with ZipFile(fileobj, "w", ZIP_DEFLATED, allowZip64=True) as archive:
+        with archive.open(ws.path[1:], "w", force_zip64=True) as entry:
+            ws._writer = WorksheetWriter(ws, out=entry)
+            ws._writer.write_top()
+            for row in _t13_rows(ws, data):
+                ws.append(row)
+            ws.close()
+        _StreamedSheetWriter(wb, archive).write_data()
+
+
+class _QueueWriter:
+    """Write-only, non-seekable file object that hands buffered chunks to a queue."""
+
+    def __init__(self, chunks: queue.Queue, cancelled: threading.Event, chunk_size: int):
+        self._chunks = chunks
+        self._cancelled = cancelled
+        self._chunk_size = chunk_size
+        self._buffer = bytearray()
+
+    def write(self, data) -> int:
+        self._buffer += data
+        if len(self._buffer) >= self._chunk_size:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self._buffer:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+
+    def _put(self, item):
+        while True:
+            if self._cancelled.is_set():
+                raise RuntimeError("Workbook stream cancelled by the client")
+            try:
+                self._chunks.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+
+def stream_workbook(write: Callable, chunk_size: int = 64 * 1024, max_chunks: int = 16):
+    """Runs write(fileobj) on a background thread, yielding the bytes it writes.
+
+    The queue is bounded, so a slow client applies back-pressure to the writer
+    instead of letting the file pile up in memory.
+    """
+    chunks: queue.Queue = queue.Queue(maxsize=max_chunks)
+    cancelled = threading.Event()
+    done = object()
+
+    def _render():
+        sink = _QueueWriter(chunks, cancelled, chunk_size)
+        try:
+            with metrics.phase("render"):
+                write(sink)
+                sink.flush()
+            sink._put(done)
+        except BaseException as exc:
+            if not cancelled.is_set():
+                sink._put(exc)
+
+    # Run in a copy of the request's context so the render time is attributed to it
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(_render,),
+                              name="xlsx-stream", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        cancelled.set()
@@ -0,0 +1,136 @@
+"""
+Organisation-wide T-13 export: one workbook per department subtree, rendered
+in a process pool and streamed back as a ZIP archive.
+
+The request handler loads the month once (load_t13_slices) and hands each
+worker a plain T13Data slice, so workers never open a database session.
+Workbooks are added to the archive in the order they finish. Each worker runs
+under an address-space limit (T13_WORKER_MAX_MB); a workbook that hits it is
+reported in ERRORS.txt inside the archive instead of failing the download.
+"""
+import io
+import multiprocessing
+import os
+import threading
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterable, List, Optional, Tuple
+
+from t13_export import T13Data, build_t13_workbook
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+ZIP_MEDIA_TYPE = "application/zip"
+
+T13_ZIP_WORKERS = int(os.getenv("T13_ZIP_WORKERS", str(min(4, os.cpu_count() or 1))))
+T13_WORKER_MAX_MB = int(os.getenv("T13_WORKER_MAX_MB", "1024"))
+
+_lock = threading.Lock()
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _limit_memory(max_mb: int):
+    if resource is not None and max_mb > 0:
+        limit = max_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _render(data: T13Data) -> bytes:
+    buf = io.BytesIO()
+    build_t13_workbook(data).save(buf)
+    return buf.getvalue()
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """Shared worker pool, started on first use.
+
+    Workers are spawned rather than forked: the API process is multi-threaded
+    and holds pooled database connections that must not leak into children.
+    """
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=max(1, T13_ZIP_WORKERS),
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_limit_memory,
+                initargs=(T13_WORKER_MAX_MB,),
+            )
+        return _pool
+
+
+def _reset_pool(pool: ProcessPoolExecutor):
+    """Drops a pool that can no longer take work; the next request starts a new one."""
+    global _pool
+    with _lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+class _ChunkSink:
+    """Write-only, non-seekable target for ZipFile; drained by the generator."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def write(self, data) -> int:
+        self._buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def stream_t13_zip(items: Iterable[Tuple[str, T13Data]]):
+    """Renders (filename, data) pairs in the pool and yields the ZIP as they finish."""
+    pool = get_pool()
+    futures = {}
+    try:
+        for filename, data in items:
+            futures[pool.submit(_render, data)] = filename
+    except Exception:
+        _reset_pool(pool)
+        raise
+
+    sink = _ChunkSink()
+    errors: List[str] = []
+    pending = set(futures)
+    try:
+        # xlsx files are already deflated; storing them keeps the workers as the only CPU cost
+        with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as archive:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    filename = futures[future]
+                    try:
+                        payload = future.result()
+                    except MemoryError:
+                        errors.append(f"{filename}: exceeded the {T13_WORKER_MAX_MB} MB worker memory limit")
+                        continue
+                    except BrokenProcessPool:
+                        # A worker died, e.g. killed by the OS at the memory limit
+                        _reset_pool(pool)
+                        errors.append(f"{filename}: worker process terminated abruptly")
+                        continue
+                    except Exception as exc:
+                        errors.append(f"{filename}: {exc.__class__.__name__}: {exc}")
+                        continue
+                    archive.writestr(filename, payload)
+                    yield sink.drain()
+            if errors:
+                archive.writestr("ERRORS.txt", "\n".join(errors) + "\n")
+        yield sink.drain()
+    finally:
+        # Client went away (or we are done): don't keep rendering for nobody
+        for future in pending:
+            future.cancel()